@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, session
+from flask import Flask, request, jsonify, session, Response, stream_with_context
 from flask_cors import CORS
 import os
 from openai import AzureOpenAI
@@ -9,9 +9,8 @@ import uuid
 from datetime import datetime, timedelta
 import io
 import base64
-from azure.ai.projects import AIProjectClient
-from azure.identity import DefaultAzureCredential
-from azure.ai.projects.models import BingGroundingTool
+from azure.core.exceptions import ClientAuthenticationError, HttpResponseError, ResourceNotFoundError
+from azure.ai.projects.models import AgentStreamEvent, BingGroundingTool, MessageRole, TruncationObject
 from dotenv import load_dotenv 
 from pymongo import MongoClient, DESCENDING, ASCENDING
 from bson import ObjectId
@@ -21,6 +20,7 @@ from urllib.parse import quote_plus
 from functools import wraps
 from jose import jwt, JWTError
 import hashlib
+import threading
 
 load_dotenv()
 
@@ -30,11 +30,34 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 
 from document_utils import (
-    extract_text_from_document
+    extract_text_from_document, is_extraction_error
 )
 
 from title import(sanitize_title)
 
+from conversation_store import create_conversation_store
+
+from maintenance import MaintenanceScheduler
+
+from chat_repository import ChatRepository
+
+from extraction_cache import create_extraction_cache
+
+from ingestion import DocumentIngestor
+
+from prompt_builder import build_budgeted_prompt, message_text
+from document_index import retrieve_document_passages, update_document_index
+from document_store import DocumentStore
+
+from indexes import IndexManager
+
+from clients import LazyClient, lazy_collection
+
+from grounding_client import GROUNDING_THREAD_MAX_MESSAGES, GroundingClientPool, StageTimer
+from grounding_cache import GroundingCache, grounding_cache_key
+
+from pagination import MAX_CHAT_MESSAGES, CountCache, decode_cursor, encode_cursor, keyset_filter, parse_int_param, parse_limit
+
 from image_generation import(generate_image)
 
 from auth_middleware import require_auth, validate_token, get_token_from_header
@@ -52,82 +75,135 @@ ASSISTANT_PROMPT = os.environ.get("ASSISTANT_PROMPT")
 
 PROJECT_PROMPT = os.environ.get("PROJECT_PROMPT")
 
-# MongoDB Cosmos DB Connection
-password = os.environ.get('COSMOS_DB_PASSWORD')
-connection_string_template = os.environ.get('COSMOS_DB_URL')
-
-# Convert <password> to {password} for Python's .format() method
-connection_string_template = connection_string_template.replace('<password>', '{password}')
-
-# URL encode the password
-encoded_password = quote_plus(password)
-
-# Replace the {password} placeholder with the encoded password
-connection_string = connection_string_template.format(password=encoded_password)
-print(connection_string)
 # Database name from environment
 COSMOS_DB_NAME = os.environ.get('COSMOS_DB_NAME')
 
-# Initialize MongoDB client
-mongo_client = MongoClient(connection_string)
-db = mongo_client[COSMOS_DB_NAME]
+def get_connection_string():
+    """Build the Cosmos DB connection string from the URL template and password."""
+    password = os.environ.get('COSMOS_DB_PASSWORD')
+    connection_string_template = os.environ.get('COSMOS_DB_URL')
 
-chats_collection = db["chats"]
-conversations_collection = db["conversations"]
+    # Convert <password> to {password} for Python's .format() method
+    connection_string_template = connection_string_template.replace('<password>', '{password}')
 
-projects_collection = db["projects"]
-project_documents_collection = db["project_documents"]
+    # Replace the {password} placeholder with the URL encoded password
+    return connection_string_template.format(password=quote_plus(password))
 
-# Create indexes for better performance
-chats_collection.create_index([("is_deleted", ASCENDING), ("updated_at", DESCENDING)])
-conversations_collection .create_index([("chat_id", ASCENDING), ("order", ASCENDING)])
+# MongoDB Cosmos DB Connection, made on first use; resolving a mongodb+srv URL blocks on DNS
+mongo_client = LazyClient(lambda: MongoClient(get_connection_string()), "MongoDB")
+db = LazyClient(lambda: mongo_client[COSMOS_DB_NAME], "database")
 
-projects_collection.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
-project_documents_collection.create_index([("project_id", ASCENDING)])
+chats_collection = lazy_collection(db, "chats")
+conversations_collection = lazy_collection(db, "conversations")
+
+projects_collection = lazy_collection(db, "projects")
+project_documents_collection = lazy_collection(db, "project_documents")
+
+# Creates the indexes declared in indexes.py in the background once create_app runs
+index_manager = IndexManager(db)
  
 #Initialize the project management module with the app and database
 
 
-# Updated conversation context storage to support multiple documents
-# Format: {conversation_id: {"messages": [], "documents": [], "last_accessed": timestamp}}
-conversation_contexts = {}
- 
 MAX_CONVERSATION_HISTORY = int(os.environ.get("MAX_CONVERSATION_HISTORY"))
 CONVERSATION_EXPIRY_HOURS = int(os.environ.get("CONVERSATION_EXPIRY_HOURS"))
 MAX_DOCUMENTS_PER_CONVERSATION = int(os.environ.get("MAX_DOCUMENTS_PER_CONVERSATION"))  # Limit the number of documents per conversation
 MAX_DOCUMENT_SIZE_MB = int(os.environ.get("MAX_DOCUMENT_SIZE_MB"))  # Maximum document size in MB
+MAX_COMPLETION_TOKENS = 2000
+# Turns loaded when a chat is brought back into memory; anything older is trimmed from prompts anyway
+HYDRATED_TURNS = max(1, MAX_CONVERSATION_HISTORY // 2)
+
+# Conversation context storage supporting multiple documents, bounded by memory and shared across workers
+# Format: {conversation_id: {"messages": [], "documents": [], "last_accessed": timestamp, "user_id": ...}}
+conversation_store = create_conversation_store(CONVERSATION_EXPIRY_HOURS * 3600)
+
+# Per-user chat totals for the sidebar, refreshed at most once a minute
+chat_count_cache = CountCache()
+
+# Shared persistence for chat turns from every endpoint
+# New chats change the user's chat count, so its cached value is dropped
+chat_repository = ChatRepository(chats_collection, conversations_collection,
+                                 on_chat_created=chat_count_cache.invalidate)
+
+# Shared Azure AI Project client and Bing connection for grounding requests
+grounding_client_pool = GroundingClientPool()
+grounding_cache = GroundingCache()
+
+# Content-addressed cache so re-uploaded documents are not parsed again
+extraction_cache = create_extraction_cache(lazy_collection(db, "extraction_cache"))
+
+# Parses uploaded documents in parallel worker processes
+document_ingestor = DocumentIngestor(extraction_cache)
+
+# Extracted document text stored once per content hash and referenced by chats and projects
+document_store = DocumentStore(lazy_collection(db, "document_contents"), lazy_collection(db, "document_chunks"), project_documents_collection)
+
+# Expire conversations, archive old chats and collect unreferenced document text in the background
+maintenance_scheduler = MaintenanceScheduler(conversation_store, chats_collection, lazy_collection(db, "locks"),
+                                             document_store=document_store, projects_collection=projects_collection)
  
-text_client = AzureOpenAI(
-    azure_endpoint=TEXT_ENDPOINT,
-    api_key=TEXT_API_KEY,
-    api_version=TEXT_API_VERSION
+text_client = LazyClient(
+    lambda: AzureOpenAI(
+        azure_endpoint=TEXT_ENDPOINT,
+        api_key=TEXT_API_KEY,
+        api_version=TEXT_API_VERSION
+    ),
+    "Azure OpenAI"
 )
  
 # init_project_management(app, db)
 
+def turns_to_messages(turns):
+    """Expand stored user/assistant message pairs into chat messages."""
+    messages = []
+    for turn in turns:
+        messages.append({
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": turn.get("user_role", "")
+                }
+            ]
+        })
+        messages.append({
+            "role": "assistant",
+            "content": [
+                {
+                    "type": "text",
+                    "text": turn.get("assistant_role", "")
+                }
+            ]
+        })
+    return messages
+
 def get_or_create_conversation(conversation_id=None, user_id=None):
-    """Get an existing conversation or create a new one, using both memory and database."""
+    """Get an existing conversation or create a new one, using both memory and database.
+
+    With a user_id, returns (None, None) if the conversation exists but
+    belongs to another user (or was deleted), so callers can refuse the
+    request before anything is read from or added to the conversation.
+    """
     now = datetime.now()
     
-    # If conversation_id provided and exists in memory, return it
-    if conversation_id and conversation_id in conversation_contexts:
-        # Update last accessed time
-        conversation_contexts[conversation_id]["last_accessed"] = now
-        
+    # If conversation_id provided and exists in the store, return it
+    conversation_context = conversation_store.get(conversation_id) if conversation_id else None
+    if conversation_context is not None:
         # If user_id provided, verify ownership or update if missing
         if user_id:
-            context_user_id = conversation_contexts[conversation_id].get("user_id")
+            context_user_id = conversation_context.get("user_id")
             if context_user_id and context_user_id != user_id:
                 # Ownership mismatch - this shouldn't normally happen
                 logger.warning(f"User ID mismatch for conversation {conversation_id}: {context_user_id} vs {user_id}")
                 return None, None
-            else:
+            elif not context_user_id:
                 # Update user_id if not set
-                conversation_contexts[conversation_id]["user_id"] = user_id
+                conversation_context["user_id"] = user_id
+                conversation_store.put(conversation_id, conversation_context)
                 
-        return conversation_id, conversation_contexts[conversation_id]
+        return conversation_id, conversation_context
     
-    # If conversation_id provided but not in memory, check database
+    # If conversation_id provided but not in the store, check database
     if conversation_id:
         query = {"_id": conversation_id, "is_deleted": False}
         
@@ -138,215 +214,237 @@ def get_or_create_conversation(conversation_id=None, user_id=None):
         chat = chats_collection.find_one(query)
         
         if chat:
-            # Chat exists in DB but not in memory, load it
+            # Chat exists in DB but not in the store, load it
             logger.info(f"Loading conversation {conversation_id} from database for user {user_id}")
             
-            # Create conversation context in memory
-            conversation_contexts[conversation_id] = {
+            # Create conversation context
+            conversation_context = {
                 "messages": [],
                 "documents": [],
                 "last_accessed": now,
                 "user_id": chat.get("user_id")  # Store user_id in context
             }
             
-            # Load messages from the conversations collection
-            messages = list(conversations_collection.find(
-                {"chat_id": conversation_id}
-            ).sort("order", ASCENDING))
-            
-            if messages:
-                # Convert messages to format expected by your application
-                for msg in messages:
-                    # Add user message
-                    conversation_contexts[conversation_id]["messages"].append({
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": msg.get("user_role", "")
-                            }
-                        ]
-                    })
-                    
-                    # Add assistant message
-                    conversation_contexts[conversation_id]["messages"].append({
-                        "role": "assistant",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": msg.get("assistant_role", "")
-                            }
-                        ]
-                    })
+            # Only the most recent turns can make it into a prompt, so only those are loaded
+            turns = chat_repository.load_turns(conversation_id, HYDRATED_TURNS)
+            conversation_context["messages"] = turns_to_messages(turns)
             
-            # If there are document references in the chat, we could load them here
-            if chat.get("document_names"):
-                logger.info(f"Chat has documents: {chat['document_names']}")
-                # Note: You'd need to implement document retrieval logic here
+            # List the chat's stored documents; their text is loaded when a prompt needs it
+            conversation_context["documents"] = document_store.list_documents(chat_id=conversation_id, user_id=chat.get("user_id"))
+            if conversation_context["documents"]:
+                logger.info(f"Chat has {len(conversation_context['documents'])} stored document(s)")
             
-            return conversation_id, conversation_contexts[conversation_id]
-        elif user_id:
-            # Chat doesn't exist or doesn't belong to this user
+            conversation_store.put(conversation_id, conversation_context)
+            return conversation_id, conversation_context
+        elif user_id and chats_collection.find_one({"_id": conversation_id}, {"_id": 1}):
+            # The chat belongs to another user or was deleted
             logger.warning(f"Chat {conversation_id} not found or doesn't belong to user {user_id}")
             return None, None
     
     # Create new conversation
     new_conversation_id = str(uuid.uuid4()) if not conversation_id else conversation_id
-    conversation_contexts[new_conversation_id] = {
+    conversation_context = {
         "messages": [],
         "documents": [],
         "last_accessed": now,
         "user_id": user_id  # Store user_id in new conversation context
     }
+    conversation_store.put(new_conversation_id, conversation_context)
     
-    return new_conversation_id, conversation_contexts[new_conversation_id]
+    return new_conversation_id, conversation_context
 
-def clean_expired_conversations():
-    """Remove expired conversations from memory and mark old chats as archived in DB."""
-    now = datetime.now()
-    expiry_threshold = now - timedelta(hours=CONVERSATION_EXPIRY_HOURS)
-    
-    # Clear expired conversations from memory
-    expired_convos = [
-        cid for cid, data in conversation_contexts.items()
-        if data["last_accessed"] < expiry_threshold
-    ]
-    
-    for cid in expired_convos:
-        del conversation_contexts[cid]
-    
-    if expired_convos:
-        logger.info(f"Cleaned up {len(expired_convos)} expired conversations from memory")
-    
-    # Optional: You could also archive very old chats in the database
-    # This is separated from the memory cleanup to avoid unnecessary DB operations
-    db_cleanup_threshold = now - timedelta(days=90)  # Archive chats older than 90 days
-    
-    try:
-        archive_result = chats_collection.update_many(
+def build_chat_prompt(model_name, prompt, conversation_context, new_documents_added=False):
+    """Assemble the chat prompt from the system prompt, documents, history and the new user turn.
+
+    The prompt is fitted to the model's token budget; returns (chat_prompt, prompt_stats).
+    """
+    # Add document content if available (only for new documents or if not previously mentioned)
+    docs_previously_mentioned = any("Here are the documents" in str(m.get("content", "")) for m in conversation_context["messages"])
+    include_documents = new_documents_added or not docs_previously_mentioned
+
+    # Send only the passages relevant to this prompt rather than every document in full
+    documents = conversation_context["documents"]
+    if include_documents and documents:
+        document_store.hydrate(documents)
+        conversation_context["document_index"] = update_document_index(conversation_context.get("document_index"), documents)
+        documents = retrieve_document_passages(conversation_context["document_index"], documents, prompt)
+
+    return build_budgeted_prompt(
+        model_name,
+        ASSISTANT_PROMPT,
+        documents,
+        conversation_context["messages"],
+        prompt,
+        include_documents=include_documents,
+        new_documents_added=new_documents_added,
+        max_completion_tokens=MAX_COMPLETION_TOKENS
+    )
+
+def get_completion_params(model_name, chat_prompt, stream=False):
+    """Build the chat completion parameters for the given model."""
+    completion_params = {
+        "model": model_name,
+        "messages": chat_prompt,
+        "max_completion_tokens": MAX_COMPLETION_TOKENS,
+        "stream": stream
+    }
+
+    if model_name != 'o3-mini':
+        completion_params["temperature"] = 0.7
+
+    return completion_params
+
+def update_conversation_history(conversation_context, prompt, response_text):
+    """Append a user/assistant turn to the in-memory history and trim it."""
+    conversation_context["messages"].append({
+        "role": "user",
+        "content": [
             {
-                "is_deleted": False,
-                "updated_at": {"$lt": db_cleanup_threshold}
-            },
-            {"$set": {"is_archived": True}}
-        )
-        
-        if archive_result.modified_count > 0:
-            logger.info(f"Archived {archive_result.modified_count} old chats in the database")
-    except Exception as e:
-        logger.error(f"Error archiving old chats: {str(e)}")
+                "type": "text",
+                "text": prompt
+            }
+        ]
+    })
 
-def get_text_response(model_name, prompt, conversation_context, new_documents_added=False):
-   
-    try:
-        # Initialize system message
-        chat_prompt = [
+    conversation_context["messages"].append({
+        "role": "assistant",
+        "content": [
             {
-                "role": "system",
-                "content": [
-                    {
-                        "type": "text",
-                        "text":  ASSISTANT_PROMPT
+                "type": "text",
+                "text": response_text
             }
         ]
-    }
-]
+    })
 
-       
-        # Add document content if available (only for new documents or if not previously mentioned)
-        docs_previously_mentioned = any("Here are the documents" in str(m.get("content", "")) for m in conversation_context["messages"])
-       
-        if conversation_context["documents"] and (new_documents_added or not docs_previously_mentioned):
-            # Combine all documents into a single context message
-            combined_docs = "Here are the documents that I'd like you to work with:\n\n"
-           
-            for idx, doc in enumerate(conversation_context["documents"]):
-                combined_docs += f"DOCUMENT {idx+1}: {doc['name']}\n"
-                combined_docs += f"TYPE: {doc['type']}\n"
-                combined_docs += f"CONTENT:\n{doc['text']}\n\n"
-                combined_docs += "-" * 40 + "\n\n"
-           
-            chat_prompt.append({
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": combined_docs
-                    }
-                ]
-            })
-           
-            # Add a system acknowledgment if new documents were added
-            if new_documents_added:
-                chat_prompt.append({
-                    "role": "assistant",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": f"I've received {len(conversation_context['documents'])} document(s). I'll analyze them and can answer any questions you have about their content."
-                        }
-                    ]
-                })
-   
-        # Add existing conversation history
-        for message in conversation_context["messages"]:
-            chat_prompt.append(message)
-       
-        # Add the current user prompt
-        chat_prompt.append({
-            "role": "user",
-            "content": [
-                {
-                    "type": "text",
-                    "text": prompt
-                }
-            ]
-        })
-       
+    if len(conversation_context["messages"]) > MAX_CONVERSATION_HISTORY:
+        conversation_context["messages"] = conversation_context["messages"][-MAX_CONVERSATION_HISTORY:]
 
-        completion_params = {
-            "model": model_name,
-            "messages": chat_prompt,
-            "max_completion_tokens": 2000,
-            "stream": False
-        }
-       
-        if model_name != 'o3-mini':
-            completion_params["temperature"] = 0.7
+def get_text_response(model_name, prompt, conversation_context, new_documents_added=False, prompt_stats=None):
+    """Get a response from the text model; prompt_stats, if given, is filled with the prompt's token counts."""
+    try:
+        chat_prompt, stats = build_chat_prompt(model_name, prompt, conversation_context, new_documents_added)
+        if prompt_stats is not None:
+            prompt_stats.update(stats)
+        completion_params = get_completion_params(model_name, chat_prompt)
    
         completion = text_client.chat.completions.create(**completion_params)
         response_text = completion.choices[0].message.content
+        if completion.usage:
+            logger.info(f"Prompt for {model_name}: {stats['total_tokens']} tokens counted locally, {completion.usage.prompt_tokens} billed")
        
         # Update conversation history
-        conversation_context["messages"].append({
-            "role": "user",
-            "content": [
-                {
-                    "type": "text",
-                    "text": prompt
-                }
-            ]
-        })
-       
-        conversation_context["messages"].append({
-            "role": "assistant",
-            "content": [
-                {
-                    "type": "text",
-                    "text": response_text
-                }
-            ]
-        })
-       
-        if len(conversation_context["messages"]) > MAX_CONVERSATION_HISTORY:
-            conversation_context["messages"] = conversation_context["messages"][-MAX_CONVERSATION_HISTORY:]
+        update_conversation_history(conversation_context, prompt, response_text)
        
         return response_text
    
     except Exception as e:
         logger.error(f"Error with text model {model_name}: {str(e)}")
         return f"Error with model {model_name}: {str(e)}"
- 
+
+def stream_text_response(model_name, prompt, conversation_context, new_documents_added=False, prompt_stats=None):
+    """Yield response deltas from the text model as they arrive.
+
+    The conversation history is only updated once the stream has completed,
+    so an interrupted stream leaves the context untouched.
+    """
+    chat_prompt, stats = build_chat_prompt(model_name, prompt, conversation_context, new_documents_added)
+    if prompt_stats is not None:
+        prompt_stats.update(stats)
+    logger.info(f"Prompt for {model_name}: {stats['total_tokens']} tokens counted locally")
+    completion_params = get_completion_params(model_name, chat_prompt, stream=True)
+
+    response_parts = []
+    for chunk in text_client.chat.completions.create(**completion_params):
+        # Azure sends a leading chunk with content filter results and no choices
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            response_parts.append(delta)
+            yield delta
+
+    update_conversation_history(conversation_context, prompt, "".join(response_parts))
+
+def format_sse_event(payload):
+    """Format a payload as a server-sent event."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+def event_stream_response(events):
+    """Wrap a generator of server-sent events in a streaming response."""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            # Stop reverse proxies from buffering the event stream
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+def stream_generate_response(model_name, input_text, conversation_id, conversation_context,
+                             new_documents_added, newly_uploaded_documents, user_id):
+    """Stream a text response as server-sent events and persist it once complete.
+
+    Events are JSON objects with a "type" of "start", "delta", "done" or "error".
+    The "done" event carries the same fields as the non-streaming response.
+    """
+    document_names = [doc["name"] for doc in newly_uploaded_documents]
+
+    def generate():
+        yield format_sse_event({
+            'type': 'start',
+            'model_used': model_name,
+            'conversation_id': conversation_id
+        })
+
+        response_parts = []
+        prompt_stats = {}
+        try:
+            for delta in stream_text_response(model_name, input_text, conversation_context, new_documents_added, prompt_stats):
+                response_parts.append(delta)
+                yield format_sse_event({'type': 'delta', 'content': delta})
+        except Exception as e:
+            logger.error(f"Error streaming from text model {model_name}: {str(e)}")
+            yield format_sse_event({'type': 'error', 'error': f"Error with model {model_name}: {str(e)}"})
+            return
+
+        response_text = "".join(response_parts)
+        conversation_store.put(conversation_id, conversation_context)
+
+        if chat_repository.save_turn(conversation_id, user_id, model_name, input_text, response_text, document_names)["forbidden"]:
+            yield format_sse_event({'type': 'error', 'error': 'Access denied to this conversation'})
+            return
+
+        # Persist the uploads so they survive a reload of the chat
+        if newly_uploaded_documents:
+            document_store.add_references(newly_uploaded_documents, user_id, chat_id=conversation_id)
+
+        result = {
+            'type': 'done',
+            'response_type': 'text',
+            'response': response_text,
+            'model_used': model_name,
+            'conversation_id': conversation_id,
+            'prompt_tokens': prompt_stats.get('total_tokens'),
+            'new_documents_added': bool(newly_uploaded_documents)
+        }
+        if newly_uploaded_documents:
+            result['documents_processed'] = len(newly_uploaded_documents)
+            result['document_names'] = document_names
+            result['uploaded_documents'] = [
+                {
+                    'name': doc['name'],
+                    'type': doc['type'],
+                    'size_mb': doc['size_mb'],
+                    'uploaded_at': doc['uploaded_at']
+                }
+                for doc in newly_uploaded_documents
+            ]
+
+        yield format_sse_event(result)
+
+    return event_stream_response(generate())
+
 @app.route('/generate-response', methods=['POST'])
 @require_auth
 def generate_response():
@@ -361,6 +459,7 @@ def generate_response():
             generate_image_flag = request.form.get('generate_image', 'false').lower() == 'true'
             conversation_id = request.form.get('conversation_id')
             clear_history = request.form.get('clear_history', 'false').lower() == 'true'
+            stream_flag = request.form.get('stream', 'false').lower() == 'true'
         else:
             data = request.json or {}
             model_name = data.get('model_name', 'gpt-4o')
@@ -368,17 +467,22 @@ def generate_response():
             generate_image_flag = data.get('generate_image', False)
             conversation_id = data.get('conversation_id')
             clear_history = data.get('clear_history', False)
+            stream_flag = data.get('stream', False)
         
         if not user_id:
             return jsonify({'error': 'User ID is required'}), 400
        
-        # Clear conversation if requested
-        if clear_history and conversation_id and conversation_id in conversation_contexts:
-            del conversation_contexts[conversation_id]
-            conversation_id = None
+        # Get or create the conversation; another user's conversation is refused before it is read
+        requested_conversation_id = conversation_id
+        conversation_id, conversation_context = get_or_create_conversation(conversation_id, user_id)
+        if conversation_context is None:
+            logger.warning(f"User {user_id} attempted to access conversation {requested_conversation_id}")
+            return jsonify({'error': 'Access denied to this conversation'}), 403
        
-        # Get or create the conversation
-        conversation_id, conversation_context = get_or_create_conversation(conversation_id)
+        # Clear conversation if requested
+        if clear_history:
+            conversation_store.delete(conversation_id)
+            conversation_id, conversation_context = get_or_create_conversation(None, user_id)
        
         # Flag to track if new documents were added
         new_documents_added = False
@@ -387,89 +491,57 @@ def generate_response():
        
         # Process document uploads
         if request.content_type and 'multipart/form-data' in request.content_type:
-            # Handle multiple file uploads
+            # Handle multiple file uploads, with a single document upload for backward compatibility
             if 'documents[]' in request.files:
                 uploaded_files = request.files.getlist('documents[]')
+            elif 'document' in request.files:
+                uploaded_files = [request.files['document']]
+            else:
+                uploaded_files = []
+            uploaded_files = [document_file for document_file in uploaded_files if document_file.filename]
+               
+            if uploaded_files and len(conversation_context["documents"]) + len(uploaded_files) > MAX_DOCUMENTS_PER_CONVERSATION:
+                return jsonify({
+                    'error': f'Document limit exceeded. Maximum {MAX_DOCUMENTS_PER_CONVERSATION} documents allowed per conversation.'
+                }), 400
+               
+            # Validate every file before extracting any of them
+            uploads = []
+            for document_file in uploaded_files:
+                # Check file size
+                document_file.seek(0, os.SEEK_END)
+                file_size_mb = document_file.tell() / (1024 * 1024)  # Convert to MB
+                document_file.seek(0)  # Reset file pointer
                
-                if len(conversation_context["documents"]) + len(uploaded_files) > MAX_DOCUMENTS_PER_CONVERSATION:
+                if file_size_mb > MAX_DOCUMENT_SIZE_MB:
                     return jsonify({
-                        'error': f'Document limit exceeded. Maximum {MAX_DOCUMENTS_PER_CONVERSATION} documents allowed per conversation.'
+                        'error': f'File {document_file.filename} exceeds maximum size of {MAX_DOCUMENT_SIZE_MB}MB'
                     }), 400
                
-                for document_file in uploaded_files:
-                    if document_file.filename:
-                        # Check file size
-                        document_file.seek(0, os.SEEK_END)
-                        file_size_mb = document_file.tell() / (1024 * 1024)  # Convert to MB
-                        document_file.seek(0)  # Reset file pointer
-                       
-                        if file_size_mb > MAX_DOCUMENT_SIZE_MB:
-                            return jsonify({
-                                'error': f'File {document_file.filename} exceeds maximum size of {MAX_DOCUMENT_SIZE_MB}MB'
-                            }), 400
-                       
-                        # Get file extension
-                        _, file_extension = os.path.splitext(document_file.filename)
-                        document_name = document_file.filename
-                       
-                        document_text = extract_text_from_document(document_file, file_extension)
-                        logger.info(f"Document processed: {document_file.filename}")
-                       
-                        # Create document object
-                        document_obj = {
-                            "name": document_name,
-                            "text": document_text,
-                            "type": file_extension.lower(),
-                            "uploaded_at": datetime.now().isoformat(),
-                            "size_mb": file_size_mb
-                        }
-                        
-                        # Add to the conversation context
-                        conversation_context["documents"].append(document_obj)
-                        # NEW: Add to the newly uploaded documents list for response
-                        newly_uploaded_documents.append(document_obj)
-                        new_documents_added = True
-                       
-            # Also handle single document upload for backward compatibility
-            elif 'document' in request.files:
-                document_file = request.files['document']
-                if document_file.filename:
-                    
-                    if len(conversation_context["documents"]) + 1 > MAX_DOCUMENTS_PER_CONVERSATION:
-                        return jsonify({
-                            'error': f'Document limit exceeded. Maximum {MAX_DOCUMENTS_PER_CONVERSATION} documents allowed per conversation.'
-                        }), 400
-                   
-                    # Check file size
-                    document_file.seek(0, os.SEEK_END)
-                    file_size_mb = document_file.tell() / (1024 * 1024)  # Convert to MB
-                    document_file.seek(0)  # Reset file pointer
-                   
-                    if file_size_mb > MAX_DOCUMENT_SIZE_MB:
-                        return jsonify({
-                            'error': f'File {document_file.filename} exceeds maximum size of {MAX_DOCUMENT_SIZE_MB}MB'
-                        }), 400
-                   
-                    _, file_extension = os.path.splitext(document_file.filename)
-                    document_name = document_file.filename
-                   
-                    document_text = extract_text_from_document(document_file, file_extension)
-                    logger.info(f"Document processed: {document_file.filename}")
-                   
-                    # Create document object
-                    document_obj = {
-                        "name": document_name,
-                        "text": document_text,
-                        "type": file_extension.lower(),
-                        "uploaded_at": datetime.now().isoformat(),
-                        "size_mb": file_size_mb
-                    }
-                    
-                    # Add to the conversation context
-                    conversation_context["documents"].append(document_obj)
-                    # NEW: Add to the newly uploaded documents list for response
-                    newly_uploaded_documents.append(document_obj)
-                    new_documents_added = True
+                # Get file extension
+                _, file_extension = os.path.splitext(document_file.filename)
+                uploads.append((document_file.filename, file_extension, file_size_mb, document_file.read()))
+               
+            # Extract all documents concurrently; results come back in upload order
+            document_texts = document_ingestor.extract_all([(data, file_extension) for _, file_extension, _, data in uploads])
+               
+            for (document_name, file_extension, file_size_mb, _), document_text in zip(uploads, document_texts):
+                logger.info(f"Document processed: {document_name}")
+               
+                # Create document object
+                document_obj = {
+                    "name": document_name,
+                    "text": document_text,
+                    "type": file_extension.lower(),
+                    "uploaded_at": datetime.now().isoformat(),
+                    "size_mb": file_size_mb
+                }
+                
+                # Add to the conversation context
+                conversation_context["documents"].append(document_obj)
+                # NEW: Add to the newly uploaded documents list for response
+                newly_uploaded_documents.append(document_obj)
+                new_documents_added = True
        
         elif request.json:
             if 'document_content' in request.json and 'document_name' in request.json:
@@ -520,6 +592,9 @@ def generate_response():
                         new_documents_added = True
        
        
+        if new_documents_added:
+            conversation_store.put(conversation_id, conversation_context)
+       
         if not input_text and new_documents_added:
             input_text = "Please analyze these documents and provide a summary of their key points."
        
@@ -540,7 +615,15 @@ def generate_response():
             else:
                 return jsonify({'error': f"Image generation failed: {image_result['error']}"}), 500
      
-        response_text = get_text_response(model_name, input_text, conversation_context, new_documents_added)
+        if stream_flag:
+            return stream_generate_response(
+                model_name, input_text, conversation_id, conversation_context,
+                new_documents_added, newly_uploaded_documents, user_id
+            )
+     
+        prompt_stats = {}
+        response_text = get_text_response(model_name, input_text, conversation_context, new_documents_added, prompt_stats)
+        conversation_store.put(conversation_id, conversation_context)
        
         if response_text.startswith("Error:"):
             return jsonify({'error': response_text}), 400
@@ -549,7 +632,8 @@ def generate_response():
             'response_type': 'text',
             'response': response_text,
             'model_used': model_name,
-            'conversation_id': conversation_id
+            'conversation_id': conversation_id,
+            'prompt_tokens': prompt_stats.get('total_tokens')
         }
      
         # MODIFIED: Return information about newly uploaded documents only
@@ -570,80 +654,17 @@ def generate_response():
         else:
             result['new_documents_added'] = False
        
-        clean_expired_conversations()
+        # Use newly uploaded documents for the database save
+        document_names = [doc["name"] for doc in newly_uploaded_documents]
 
-        try:
-            # Get chat title from first message or use sanitized input text
-            chat_title= sanitize_title(input_text)
-            chat_id = result['conversation_id']
-            existing_chat = chats_collection.find_one({"_id": chat_id})
-            
-            # Use newly uploaded documents for the database save
-            document_names = []
-            if newly_uploaded_documents:
-                document_names = [doc["name"] for doc in newly_uploaded_documents]
-            
-            now = datetime.now()
-            
-            if existing_chat:
-                # Optionally check if the user owns this chat
-                if existing_chat.get('user_id') and existing_chat.get('user_id') != user_id:
-                    return jsonify({'error': 'Access denied to this conversation'}), 403
-                    
-                # Update existing chat
-                chats_collection.update_one(
-                    {"_id": chat_id},
-                    {
-                        "$set": {
-                            "updated_at": now,
-                            "model_name": model_name,
-                            "document_names": document_names,
-                            "message_count": existing_chat.get("message_count", 0) + 1,
-                            "user_id": user_id  # Update user_id if changed or not set
-                        }
-                    }
-                )
-            else:
-                # Create new chat
-                chats_collection.insert_one({
-                    "_id": chat_id,
-                    "title": chat_title,
-                    "created_at": now,
-                    "updated_at": now,
-                    "model_name": model_name,
-                    "document_names": document_names,
-                    "message_count": 1,  # Initial message pair (user + assistant)
-                    "is_deleted": False,
-                    "user_id": user_id  # Store the OID
-                })
-            
-            # Get next message order and store message with user_id
-            next_order = 1
-            last_message = conversations_collection.find_one(
-                {"chat_id": chat_id},
-                sort=[("order", -1)]
-            )
-            if last_message:
-                next_order = last_message.get("order", 0) + 1
-            
-            # Insert message with user_id
-            conversations_collection.insert_one({
-                "_id": str(ObjectId()),
-                "chat_id": chat_id,
-                "user_role": input_text,
-                "assistant_role": response_text,
-                "content_type": "text", 
-                "created_at": now,
-                "order": next_order,
-                "user_id": user_id  # Store the OID
-            })
-            
-            logger.info(f"Saved chat and message to Cosmos DB for conversation {chat_id} (User: {user_id})")
-        except Exception as e:
-            logger.error(f"Error saving chat data to Cosmos DB: {str(e)}")
+        if chat_repository.save_turn(conversation_id, user_id, model_name, input_text, response_text, document_names)["forbidden"]:
+            return jsonify({'error': 'Access denied to this conversation'}), 403
+
+        # Persist the uploads so they survive a reload of the chat
+        if newly_uploaded_documents:
+            document_store.add_references(newly_uploaded_documents, user_id, chat_id=conversation_id)
         
         return jsonify(result)
-            # Continue processing even if DB save fails
         
     except Exception as e:
         logger.error(f"Error in generate_response: {str(e)}")
@@ -657,10 +678,13 @@ def get_chats():
         # Get user ID from authenticated request
         user_id = request.user['id']
         
-        # Get query parameters for pagination
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 30))
-        skip = (page - 1) * limit
+        # Get query parameters for pagination; a cursor takes precedence over page numbers
+        cursor = request.args.get('cursor')
+        try:
+            page = max(1, parse_int_param(request.args.get('page'), 1, "page"))
+            limit = parse_limit(request.args.get('limit'), 30)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Query for active chats for this user
         query = {
@@ -668,8 +692,15 @@ def get_chats():
             "user_id": user_id
         }
         
-        chats = list(chats_collection.find(
-            query,
+        find_query = query
+        if cursor:
+            try:
+                find_query = {**query, **keyset_filter(*decode_cursor(cursor))}
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        
+        chats_cursor = chats_collection.find(
+            find_query,
             {
                 "_id": 1, 
                 "title": 1, 
@@ -679,7 +710,16 @@ def get_chats():
                 "message_count": 1,
                 "document_names": 1
             }
-        ).sort("updated_at", DESCENDING).skip(skip).limit(limit))
+        ).sort([("updated_at", DESCENDING), ("_id", DESCENDING)])
+        if not cursor and page > 1:
+            # Legacy page numbers still skip; clients should follow next_cursor instead
+            chats_cursor = chats_cursor.skip((page - 1) * limit)
+        
+        # Fetch one extra chat to know whether another page exists
+        chats = list(chats_cursor.limit(limit + 1))
+        has_more = len(chats) > limit
+        chats = chats[:limit]
+        next_cursor = encode_cursor(chats[-1]['updated_at'], chats[-1]['_id']) if has_more else None
         
         # Convert datetime objects to strings
         for chat in chats:
@@ -688,14 +728,17 @@ def get_chats():
             if isinstance(chat.get('updated_at'), datetime):
                 chat['updated_at'] = chat['updated_at'].isoformat()
         
-        total_chats = chats_collection.count_documents(query)
+        # The total is cached briefly rather than counted on every page
+        total_chats = chat_count_cache.get_or_count(user_id, lambda: chats_collection.count_documents(query))
         
         return jsonify({
             "chats": chats,
             "total": total_chats,
-            "page": page,
+            "page": None if cursor else page,
             "limit": limit,
-            "pages": (total_chats + limit - 1) // limit
+            "pages": (total_chats + limit - 1) // limit,
+            "has_more": has_more,
+            "next_cursor": next_cursor
         })
         
     except Exception as e:
@@ -720,10 +763,21 @@ def get_chat_messages(chat_id):
         if not chat:
             return jsonify({'error': 'Chat not found or access denied'}), 404
         
-        # Get all message documents for this chat
-        messages = list(conversations_collection.find(
-            {"chat_id": chat_id, "user_id": user_id}
-        ).sort("order", ASCENDING))
+        # The latest `limit` messages before the `before` order are returned; without
+        # a limit, up to MAX_CHAT_MESSAGES of them so no request reads a huge chat whole
+        message_query = {"chat_id": chat_id, "user_id": user_id}
+        try:
+            limit = parse_limit(request.args.get('limit'), 50) if request.args.get('limit') else MAX_CHAT_MESSAGES
+            before = parse_int_param(request.args.get('before'), None, "before")
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if before is not None:
+            message_query["order"] = {"$lt": before}
+        messages = list(conversations_collection.find(message_query).sort("order", DESCENDING).limit(limit + 1))
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        messages.reverse()
+        next_before = messages[0].get("order") if has_more else None
         
         # Convert datetime objects to strings
         if isinstance(chat.get('created_at'), datetime):
@@ -736,12 +790,14 @@ def get_chat_messages(chat_id):
                 message['created_at'] = message['created_at'].isoformat()
         
         # Load the conversation into memory if it's not already there
-        if chat_id not in conversation_contexts:
-            get_or_create_conversation(chat_id)
+        if chat_id not in conversation_store:
+            get_or_create_conversation(chat_id, user_id)
         
         return jsonify({
             "chat": chat,
-            "messages": messages
+            "messages": messages,
+            "has_more": has_more,
+            "next_before": next_before
         })
         
     except Exception as e:
@@ -834,8 +890,11 @@ def delete_chat(chat_id):
                 logger.info(f"Soft deleted chat {chat_id} and hard deleted {conversations_delete_result.deleted_count} conversations for user {user_id}")
         
         # Remove from in-memory storage if present
-        if chat_id in conversation_contexts:
-            del conversation_contexts[chat_id]
+        conversation_store.delete(chat_id)
+        chat_count_cache.invalidate(user_id)
+
+        # Documents stay stored until the maintenance job finds nothing references them
+        document_store.remove_references(chat_id=chat_id, user_id=user_id)
             
         return jsonify({
             'success': True, 
@@ -858,7 +917,9 @@ def clear_all_chats():
         )
         
         # Clear in-memory conversation contexts
-        conversation_contexts.clear()
+        conversation_store.clear()
+        chat_count_cache.clear()
+        document_store.remove_references(all_chats=True)
         
         return jsonify({
             'success': True, 
@@ -898,12 +959,13 @@ def create_new_chat():
         })
         
         # Create a conversation context in memory
-        conversation_contexts[chat_id] = {
+        conversation_store.put(chat_id, {
             "messages": [],
             "documents": [],
             "last_accessed": now,
             "user_id": user_id
-        }
+        })
+        chat_count_cache.invalidate(user_id)
         
         return jsonify({
             'success': True,
@@ -914,6 +976,406 @@ def create_new_chat():
         logger.error(f"Error creating new chat: {str(e)}")
         return jsonify({'error': f"Failed to create new chat: {str(e)}"}), 500
     
+def build_grounding_context(conversation_context, grounding_state):
+    """Return the conversation context a grounding thread has not seen yet.
+
+    That is the document list if it changed and the turns since the last
+    grounding answer (at most the last five messages). With an empty
+    grounding_state it is the full context a new thread needs.
+    """
+    context = ""
+    if conversation_context:
+        documents = conversation_context["documents"]
+        if documents and len(documents) != grounding_state.get("documents_sent"):
+            context += "I have access to the following documents:\n"
+            for idx, doc in enumerate(documents):
+                context += f"Document {idx+1}: {doc['name']} ({doc['type']})\n"
+            context += "\n"
+
+        messages = conversation_context["messages"]
+        start = max(0, len(messages) - 5)
+        last_response_hash = grounding_state.get("last_response_hash")
+        if last_response_hash:
+            for idx in range(len(messages) - 1, start - 1, -1):
+                if messages[idx].get("role") == "assistant" and hashlib.sha256(message_text(messages[idx]).encode("utf-8")).hexdigest() == last_response_hash:
+                    start = idx + 1
+                    break
+
+        recent_messages = [msg for msg in messages[start:] if message_text(msg)]
+        if recent_messages:
+            context += "Here's some context from our conversation:\n"
+            for msg in recent_messages:
+                context += f"{msg.get('role', '').capitalize()}: {message_text(msg)}\n"
+            context += "\n"
+
+    return context
+
+def build_grounding_message(query, conversation_context, grounding_state):
+    """Build the thread message for a grounding query, prefixed with context the thread has not seen."""
+    context = build_grounding_context(conversation_context, grounding_state)
+    if not context:
+        return query
+    return f"""{context}Based on the above context, answer the following question:
+{query}"""
+
+def grounding_search_queries(step):
+    """Return the Bing search queries issued by a run step."""
+    queries = []
+    if step.get("type") == "tool_calls":
+        tool_calls = step.get("step_details", {}).get("tool_calls", [])
+        for call in tool_calls:
+            if call.get("type") == "bing_search":
+                input_data = call.get("bing_search", {}).get("input", {})
+                if "query" in input_data:
+                    queries.append(input_data["query"])
+    return queries
+
+def format_grounding_response(response_message):
+    """Return the response text of an agent message, with its URL citations appended, and the citations."""
+    final_response = ""
+    url_citations = []
+    
+    if response_message:
+        # Gather text from the response
+        for text_message in response_message.text_messages:
+            final_response += text_message.text.value + "\n\n"
+        
+        # Gather URL citations
+        for annotation in response_message.url_citation_annotations:
+            url_citation = {
+                "title": annotation.url_citation.title,
+                "url": annotation.url_citation.url
+            }
+            url_citations.append(url_citation)
+            
+            # Add to final response if not already there
+            citation_text = f"URL Citation: [{annotation.url_citation.title}]({annotation.url_citation.url})"
+            if citation_text not in final_response:
+                final_response += f"\n{citation_text}"
+    
+    return final_response, url_citations
+
+def grounding_sources(url_citations):
+    """Organize URL citations into the sources payload of a grounding response."""
+    sources = {}
+    for idx, citation in enumerate(url_citations):
+        sources[str(idx)] = {
+            "title": citation["title"],
+            "url": citation["url"],
+            "snippet": ""  # URL citations might not include snippets
+        }
+    return sources
+
+def update_grounding_context(conversation_id, conversation_context, grounding_state, thread_id, query, final_response):
+    """Add a grounding turn to the conversation context in the SAME FORMAT as generate_response."""
+    if not conversation_context:
+        return
+    
+    # Remember what the thread has seen so the next turn only sends what is new;
+    # answers served from the cache never reached the thread
+    if thread_id:
+        grounding_state.update({
+            "thread_id": thread_id,
+            "documents_sent": len(conversation_context["documents"]),
+            "last_response_hash": hashlib.sha256(final_response.encode("utf-8")).hexdigest()
+        })
+   
+    # Add messages to the in-memory context in the expected format
+    conversation_context["messages"].append({
+        "role": "user",
+        "content": [
+            {
+                "type": "text",
+                "text": query
+            }
+        ]
+    })
+   
+    conversation_context["messages"].append({
+        "role": "assistant",
+        "content": [
+            {
+                "type": "text",
+                "text": final_response
+            }
+        ]
+    })
+   
+    # Limit conversation history size
+    if len(conversation_context["messages"]) > MAX_CONVERSATION_HISTORY:
+        conversation_context["messages"] = conversation_context["messages"][-MAX_CONVERSATION_HISTORY:]
+
+    conversation_store.put(conversation_id, conversation_context)
+
+def reset_grounding_clients(error, agent_id=None):
+    """Drop cached grounding state that an error shows to be unusable."""
+    # A stale token or connection is the usual cause; rebuild the client next time
+    if isinstance(error, ClientAuthenticationError):
+        grounding_client_pool.invalidate()
+    # The shared agent was deleted from the project; create or find it again next time
+    elif isinstance(error, ResourceNotFoundError) and agent_id:
+        grounding_client_pool.forget_agent(agent_id)
+
+def prepare_grounding_run(timer, project_conn_str, bing_conn_name, model, query, conversation_context, grounding_state):
+    """Post a grounding query to the conversation's thread and return (project_client, agent_id, thread_id).
+
+    The returned thread is claimed for this request; the caller must release
+    it with grounding_client_pool.release_thread once the run is over, or for
+    a streamed run once its response is closed.
+    """
+    # The project client and Bing connection ID are shared across requests
+    with timer.stage("client_init"):
+        project_client, conn_id = grounding_client_pool.get(project_conn_str, bing_conn_name)
+   
+    # Initialize agent Bing tool and add the connection id
+    bing = BingGroundingTool(connection_id=conn_id)
+   
+    # Get the assistant prompt from environment variable
+    assistant_prompt = os.environ.get("BING_ASSISTANT_PROMPT")
+    
+    # Base instructions; they are the same for every conversation so the agent can be shared
+    instructions = f"""You are AN Assist, an advanced AI assistant.
+
+{assistant_prompt}
+"""
+   
+    with timer.stage("agent_create"):
+        # Long-lived agent shared by every conversation using this model and prompt
+        agent_id = grounding_client_pool.get_agent(project_client, model, instructions, bing.definitions)
+       
+        # Reuse the conversation's thread; the agent already has the earlier grounding turns
+        # unless another request of the conversation is still running on it
+        thread_id = grounding_state.get("thread_id")
+        message = None
+        if thread_id and grounding_client_pool.claim_thread(thread_id):
+            try:
+                message = project_client.agents.create_message(
+                    thread_id=thread_id,
+                    role=MessageRole.USER,
+                    content=build_grounding_message(query, conversation_context, grounding_state),
+                )
+            except HttpResponseError as e:
+                # Deleted, or busy with a run started elsewhere
+                logger.info(f"Cannot post to grounding thread {thread_id}, starting a new one: {str(e)}")
+                grounding_client_pool.release_thread(thread_id)
+        grounding_client_pool.record_thread(reused=message is not None)
+       
+        if message is None:
+            # A new thread needs the full recent context
+            thread_id = project_client.agents.create_thread().id
+            logger.info(f"Created thread, ID: {thread_id}")
+            grounding_client_pool.claim_thread(thread_id)
+            try:
+                message = project_client.agents.create_message(
+                    thread_id=thread_id,
+                    role=MessageRole.USER,
+                    content=build_grounding_message(query, conversation_context, {}),
+                )
+            except Exception:
+                grounding_client_pool.release_thread(thread_id)
+                raise
+        logger.info(f"Created message, ID: {message.id}")
+   
+    return project_client, agent_id, thread_id
+
+def run_bing_grounding(timer, project_conn_str, bing_conn_name, model, query, conversation_context, grounding_state):
+    """Run a grounding query to completion.
+
+    Returns (payload, status_code, thread_id); thread_id is None if the run
+    did not complete.
+    """
+    agent_id = thread_id = None
+    try:
+        project_client, agent_id, thread_id = prepare_grounding_run(
+            timer, project_conn_str, bing_conn_name, model, query, conversation_context, grounding_state
+        )
+       
+        with timer.stage("run"):
+            # Create and process agent run in thread with tools
+            run = project_client.agents.create_and_process_run(
+                thread_id=thread_id, 
+                agent_id=agent_id,
+                # Long-running conversations only send their latest messages to the model
+                truncation_strategy=TruncationObject(type="last_messages", last_messages=GROUNDING_THREAD_MAX_MESSAGES)
+            )
+            logger.info(f"Run finished with status: {run.status}")
+        
+        if run.status == "failed":
+            logger.error(f"Run failed: {run.last_error}")
+            grounding_client_pool.record(timer.finish())
+            return {
+                'error': f"Agent run failed: {run.last_error}",
+                'status': 'run_failed'
+            }, 500, None
+        
+        with timer.stage("message_fetch"):
+            # Extract search queries for reporting
+            search_queries = []
+            run_steps = project_client.agents.list_run_steps(
+                run_id=run.id,
+                thread_id=thread_id
+            )
+            run_steps_data = run_steps.get('data', [])
+        
+            for step in run_steps_data:
+                search_queries.extend(grounding_search_queries(step))
+        
+            # Get the response directly using get_last_message_by_role as in the SDK example
+            response_message = project_client.agents.list_messages(thread_id=thread_id).get_last_message_by_role(
+                MessageRole.AGENT
+            )
+        
+        # Process the response message
+        final_response, url_citations = format_grounding_response(response_message)
+       
+        payload = {
+            'status': 'success',
+            'query': query,
+            'model': model,
+            'response': final_response,
+            'search_queries_used': search_queries,
+            'sources': grounding_sources(url_citations),
+            'run_status': run.status,
+            'timings': timer.finish()
+        }
+        grounding_client_pool.record(payload['timings'])
+        logger.info(f"Bing Grounding timings: {payload['timings']}")
+        return payload, 200, thread_id
+       
+    except Exception as e:
+        logger.error(f"Error during Bing Grounding API call: {str(e)}")
+        reset_grounding_clients(e, agent_id)
+        return {
+            'error': f"Azure AI Project client error: {str(e)}",
+            'status': 'api_error'
+        }, 500, None
+    finally:
+        if thread_id:
+            grounding_client_pool.release_thread(thread_id)
+
+def stream_cached_grounding(payload, timer, query, model, conversation_id, conversation_context, grounding_state, user_id):
+    """Replay a cached grounding answer as the same events a live grounding stream sends."""
+    def generate():
+        yield format_sse_event({
+            'type': 'start',
+            'query': query,
+            'model': model,
+            'conversation_id': conversation_id
+        })
+        if payload['search_queries_used']:
+            yield format_sse_event({'type': 'search', 'queries': payload['search_queries_used']})
+        for source in payload['sources'].values():
+            yield format_sse_event({'type': 'citation', 'title': source['title'], 'url': source['url']})
+        yield format_sse_event({'type': 'delta', 'content': payload['response']})
+
+        update_grounding_context(conversation_id, conversation_context, grounding_state, None, query, payload['response'])
+        if chat_repository.save_turn(conversation_id, user_id, model, query, payload['response'])["forbidden"]:
+            yield format_sse_event({'type': 'error', 'error': 'Access denied to this conversation'})
+            return
+
+        yield format_sse_event(dict(payload, type='done', conversation_id=conversation_id, cache='hit', timings=timer.finish()))
+
+    return event_stream_response(generate())
+
+def stream_bing_grounding(project_client, agent_id, thread_id, timer, query, model,
+                          conversation_id, conversation_context, grounding_state, user_id, cache_key=None):
+    """Stream a grounding run as server-sent events, persist it and cache it once complete.
+
+    Events are JSON objects with a "type" of "start", "search", "citation",
+    "delta", "done" or "error". Search queries and citations are sent as the
+    agent produces them; the "done" event carries the same fields as the
+    non-streaming response.
+    """
+    def generate():
+        yield format_sse_event({
+            'type': 'start',
+            'query': query,
+            'model': model,
+            'conversation_id': conversation_id
+        })
+
+        search_queries = []
+        cited_urls = set()
+        response_message = None
+        run = None
+        try:
+            with timer.stage("run"):
+                with project_client.agents.create_stream(
+                    thread_id=thread_id,
+                    agent_id=agent_id,
+                    # Long-running conversations only send their latest messages to the model
+                    truncation_strategy=TruncationObject(type="last_messages", last_messages=GROUNDING_THREAD_MAX_MESSAGES)
+                ) as stream:
+                    for event_type, event_data, _ in stream:
+                        if event_type == AgentStreamEvent.THREAD_MESSAGE_DELTA:
+                            if event_data.text:
+                                timer.mark("first_delta")
+                                yield format_sse_event({'type': 'delta', 'content': event_data.text})
+                            for content in event_data.delta.content or []:
+                                for annotation in getattr(getattr(content, "text", None), "annotations", None) or []:
+                                    citation = getattr(annotation, "url_citation", None)
+                                    if citation and citation.url and citation.url not in cited_urls:
+                                        cited_urls.add(citation.url)
+                                        yield format_sse_event({'type': 'citation', 'title': citation.title, 'url': citation.url})
+                        elif event_type == AgentStreamEvent.THREAD_RUN_STEP_COMPLETED:
+                            queries = grounding_search_queries(event_data)
+                            if queries:
+                                search_queries.extend(queries)
+                                yield format_sse_event({'type': 'search', 'queries': queries})
+                        elif event_type == AgentStreamEvent.THREAD_MESSAGE_COMPLETED:
+                            if event_data.role == MessageRole.AGENT:
+                                response_message = event_data
+                        elif event_type in (AgentStreamEvent.THREAD_RUN_COMPLETED, AgentStreamEvent.THREAD_RUN_FAILED):
+                            run = event_data
+                        elif event_type == AgentStreamEvent.ERROR:
+                            raise RuntimeError(event_data)
+        except Exception as e:
+            logger.error(f"Error during Bing Grounding stream: {str(e)}")
+            reset_grounding_clients(e, agent_id)
+            grounding_client_pool.record(timer.finish())
+            yield format_sse_event({'type': 'error', 'error': f"Azure AI Project client error: {str(e)}", 'status': 'api_error'})
+            return
+        finally:
+            # Also reached when the client disconnects and the generator is closed
+            grounding_client_pool.release_thread(thread_id)
+
+        if run is None or run.status == "failed":
+            last_error = run.last_error if run else "run ended without completing"
+            logger.error(f"Run failed: {last_error}")
+            grounding_client_pool.record(timer.finish())
+            yield format_sse_event({'type': 'error', 'error': f"Agent run failed: {last_error}", 'status': 'run_failed'})
+            return
+
+        final_response, url_citations = format_grounding_response(response_message)
+        update_grounding_context(conversation_id, conversation_context, grounding_state, thread_id, query, final_response)
+
+        payload = {
+            'status': 'success',
+            'query': query,
+            'model': model,
+            'response': final_response,
+            'search_queries_used': search_queries,
+            'sources': grounding_sources(url_citations),
+            'run_status': run.status,
+            'timings': timer.finish()
+        }
+        grounding_client_pool.record(payload['timings'])
+        logger.info(f"Bing Grounding stream timings: {payload['timings']}")
+        if cache_key:
+            grounding_cache.put(cache_key, (payload, 200))
+
+        if chat_repository.save_turn(conversation_id, user_id, model, query, final_response)["forbidden"]:
+            yield format_sse_event({'type': 'error', 'error': 'Access denied to this conversation'})
+            return
+
+        yield format_sse_event(dict(payload, type='done', conversation_id=conversation_id, cache='miss'))
+
+    response = event_stream_response(generate())
+    # The generator's finally only runs once iteration has started; a client that
+    # disconnects before that only gets the response closed
+    response.call_on_close(lambda: grounding_client_pool.release_thread(thread_id))
+    return response
+
 @app.route('/api/bing-grounding', methods=['POST'])
 @require_auth
 def bing_grounding():
@@ -929,13 +1391,14 @@ def bing_grounding():
         query = data.get('query')
         model = data.get('model', 'gpt-4o')
         conversation_id = data.get('conversation_id')
+        stream_flag = data.get('stream', False)
         
         logger.info(f"Bing Grounding API with query: {query}")
        
         # Keep existing context management but include user_id
         conversation_context = None
         if conversation_id:
-            if conversation_id in conversation_contexts:
+            if conversation_id in conversation_store:
                 conversation_id, conversation_context = get_or_create_conversation(conversation_id, user_id)
                 logger.info(f"Using existing conversation: {conversation_id}")
             else:
@@ -946,7 +1409,10 @@ def bing_grounding():
             # Create a new conversation if none provided
             conversation_id, conversation_context = get_or_create_conversation(None, user_id)
             logger.info(f"Created new conversation: {conversation_id}")
-       
+
+        if conversation_context is None:
+            return jsonify({'error': 'Access denied to this conversation'}), 403
+
         # Get environment variables with fallbacks to hardcoded values
         project_conn_str = os.environ.get("PROJECT_CONNECTION_STRING")
         bing_conn_name = os.environ.get("BING_CONNECTION_NAME")
@@ -963,288 +1429,58 @@ def bing_grounding():
                 'status': 'configuration_error'
             }), 400
        
-        # Try to initialize the Azure AI Project client
-        try:
-            # Following the structure of the provided code snippet
-            from azure.ai.projects.models import MessageRole
-            
-            # Create an Azure AI Client using DefaultAzureCredential
-            project_client = AIProjectClient.from_connection_string(
-                credential=DefaultAzureCredential(),
-                conn_str=project_conn_str,
-            )
-           
-            # Get the Bing connection
-            bing_connection = project_client.connections.get(
-                connection_name=bing_conn_name
+        # Conversation state for grounding lives with the rest of the conversation context
+        grounding_state = conversation_context.setdefault("grounding", {}) if conversation_context else {}
+       
+        # Identical questions asked with the same conversation context share one answer for a while
+        cache_key = grounding_cache_key(query, model, build_grounding_context(conversation_context, {}))
+        timer = StageTimer()
+       
+        if stream_flag:
+            cached = grounding_cache.get(cache_key)
+            if cached:
+                return stream_cached_grounding(cached[0], timer, query, model,
+                                               conversation_id, conversation_context, grounding_state, user_id)
+            try:
+                project_client, agent_id, thread_id = prepare_grounding_run(
+                    timer, project_conn_str, bing_conn_name, model, query, conversation_context, grounding_state
+                )
+            except Exception as e:
+                logger.error(f"Error during Bing Grounding API call: {str(e)}")
+                reset_grounding_clients(e)
+                return jsonify({
+                    'error': f"Azure AI Project client error: {str(e)}",
+                    'status': 'api_error'
+                }), 500
+            return stream_bing_grounding(project_client, agent_id, thread_id, timer, query, model,
+                                         conversation_id, conversation_context, grounding_state, user_id, cache_key)
+       
+        # Only a request that actually ran the agent has advanced its conversation's thread
+        run_thread = {}
+        def run_grounding():
+            payload, status, run_thread["id"] = run_bing_grounding(
+                timer, project_conn_str, bing_conn_name, model, query, conversation_context, grounding_state
             )
-            conn_id = bing_connection.id
-            logger.info(f"Retrieved Bing connection ID: {conn_id}")
-           
-            # Initialize agent Bing tool and add the connection id
-            bing = BingGroundingTool(connection_id=conn_id)
-           
-            # Generate a unique name for the agent
-            agent_name = f"agent-{uuid.uuid4()}"
-           
-            # Build context from conversation history and documents if available
-            context = ""
-           
-            if conversation_context:
-                # Add document context if available
-                if conversation_context["documents"]:
-                    context += "I have access to the following documents:\n"
-                    for idx, doc in enumerate(conversation_context["documents"]):
-                        context += f"Document {idx+1}: {doc['name']} ({doc['type']})\n"
-                    context += "\n"
-               
-                # Add conversation history context - handle both message formats
-                if conversation_context["messages"]:
-                    context += "Here's some context from our conversation:\n"
-                    # Get the last few messages
-                    recent_messages = conversation_context["messages"][-5:]
-                    for msg in recent_messages:
-                        role = msg.get("role", "")
-                        content_blocks = msg.get("content", [])
-                        
-                        # Extract message text, handling both formats
-                        msg_text = ""
-                        if isinstance(content_blocks, list):
-                            for block in content_blocks:
-                                if isinstance(block, dict) and block.get("type") == "text":
-                                    msg_text += block.get("text", "")
-                        
-                        if msg_text:
-                            context += f"{role.capitalize()}: {msg_text}\n"
-                    context += "\n"
-           
-            # Get the assistant prompt from environment variable
-            assistant_prompt = os.environ.get("BING_ASSISTANT_PROMPT")
-            
-            # Base instructions
-            instructions = f"""You are AN Assist, an advanced AI assistant.
-
-{assistant_prompt}
-
-{context}
+            return payload, status
+       
+        (payload, status), cache_source = grounding_cache.get_or_compute(
+            cache_key, run_grounding, cacheable=lambda value: value[1] == 200
+        )
+        if status != 200:
+            return jsonify(payload), status
+       
+        # Return the results with conversation_id and sources
+        result = dict(payload, conversation_id=conversation_id, cache=cache_source)
+        if cache_source != "miss":
+            result['timings'] = timer.finish()
+       
+        update_grounding_context(conversation_id, conversation_context, grounding_state, run_thread.get("id"), query, payload['response'])
+       
+        # Save to Cosmos DB in the SAME FORMAT as generate_response
+        if chat_repository.save_turn(conversation_id, user_id, model, query, payload['response'])["forbidden"]:
+            return jsonify({'error': 'Access denied to this conversation'}), 403
 
-Based on the above context, answer the following question:
-{query}
-"""
-           
-            # Create agent with the Bing tool and process assistant run - following the SDK example structure
-            with project_client:
-                # Create the agent
-                agent = project_client.agents.create_agent(
-                    model=model,
-                    name=agent_name,
-                    instructions=instructions,
-                    tools=bing.definitions,
-                    headers={"x-ms-enable-preview": "true"},
-                )
-                agent_id = agent.id
-                logger.info(f"Created agent with ID: {agent.id}")
-               
-                # Create thread for communication
-                thread = project_client.agents.create_thread()
-                logger.info(f"Created thread, ID: {thread.id}")
-               
-                # Create message in thread
-                message = project_client.agents.create_message(
-                    thread_id=thread.id,
-                    role=MessageRole.USER,
-                    content=query,
-                )
-                logger.info(f"Created message, ID: {message.id}")
-               
-                # Create and process agent run in thread with tools
-                run = project_client.agents.create_and_process_run(
-                    thread_id=thread.id, 
-                    agent_id=agent.id
-                )
-                logger.info(f"Run finished with status: {run.status}")
-                
-                if run.status == "failed":
-                    logger.error(f"Run failed: {run.last_error}")
-                    return jsonify({
-                        'error': f"Agent run failed: {run.last_error}",
-                        'status': 'run_failed'
-                    }), 500
-                
-                # Extract search queries for reporting
-                search_queries = []
-                run_steps = project_client.agents.list_run_steps(
-                    run_id=run.id,
-                    thread_id=thread.id
-                )
-                run_steps_data = run_steps.get('data', [])
-                
-                for step in run_steps_data:
-                    if step.get("type") == "tool_calls":
-                        tool_calls = step.get("step_details", {}).get("tool_calls", [])
-                        for call in tool_calls:
-                            if call.get("type") == "bing_search":
-                                input_data = call.get("bing_search", {}).get("input", {})
-                                if "query" in input_data:
-                                    search_queries.append(input_data["query"])
-                
-                # Get the response directly using get_last_message_by_role as in the SDK example
-                response_message = project_client.agents.list_messages(thread_id=thread.id).get_last_message_by_role(
-                    MessageRole.AGENT
-                )
-                
-                # Process the response message
-                final_response = ""
-                url_citations = []
-                
-                if response_message:
-                    # Gather text from the response
-                    for text_message in response_message.text_messages:
-                        final_response += text_message.text.value + "\n\n"
-                    
-                    # Gather URL citations
-                    for annotation in response_message.url_citation_annotations:
-                        url_citation = {
-                            "title": annotation.url_citation.title,
-                            "url": annotation.url_citation.url
-                        }
-                        url_citations.append(url_citation)
-                        
-                        # Add to final response if not already there
-                        citation_text = f"URL Citation: [{annotation.url_citation.title}]({annotation.url_citation.url})"
-                        if citation_text not in final_response:
-                            final_response += f"\n{citation_text}"
-                
-                # Delete the agent when done
-                try:
-                    project_client.agents.delete_agent(agent.id)
-                    logger.info("Deleted agent")
-                except Exception as e:
-                    logger.warning(f"Failed to delete agent {agent.id}: {str(e)}")
-                
-                # If conversation_context exists, update it in the SAME FORMAT as generate_response
-                if conversation_context:
-                    # Add messages to the in-memory context in the expected format
-                    conversation_context["messages"].append({
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": query
-                            }
-                        ]
-                    })
-                   
-                    conversation_context["messages"].append({
-                        "role": "assistant",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": final_response
-                            }
-                        ]
-                    })
-                   
-                    # Limit conversation history size
-                    if len(conversation_context["messages"]) > MAX_CONVERSATION_HISTORY:
-                        conversation_context["messages"] = conversation_context["messages"][-MAX_CONVERSATION_HISTORY:]
-               
-                # Organize sources for the result
-                sources = {}
-                for idx, citation in enumerate(url_citations):
-                    sources[str(idx)] = {
-                        "title": citation["title"],
-                        "url": citation["url"],
-                        "snippet": ""  # URL citations might not include snippets
-                    }
-               
-                # Return the results with conversation_id and sources
-                result = {
-                    'status': 'success',
-                    'query': query,
-                    'model': model,
-                    'response': final_response,
-                    'search_queries_used': search_queries,
-                    'sources': sources,
-                    'run_status': run.status,
-                    'conversation_id': conversation_id
-                }
-               
-                # Save to Cosmos DB in the SAME FORMAT as generate_response
-                try:
-                    # Get chat title from query
-                    chat_title = sanitize_title(query)
-                    now = datetime.now()
-                    
-                    # Store or update chat record
-                    existing_chat = chats_collection.find_one({"_id": conversation_id})
-                    
-                    if existing_chat:
-                        # Verify user ownership if the chat exists
-                        if existing_chat.get('user_id') and existing_chat.get('user_id') != user_id:
-                            logger.warning(f"User {user_id} attempted to access chat {conversation_id} owned by {existing_chat.get('user_id')}")
-                            return jsonify({'error': 'Access denied to this conversation'}), 403
-                            
-                        # Update existing chat
-                        chats_collection.update_one(
-                            {"_id": conversation_id},
-                            {
-                                "$set": {
-                                    "updated_at": now,
-                                    "model_name": model,
-                                    "message_count": existing_chat.get("message_count", 0) + 1,
-                                    "user_id": user_id  # Ensure user_id is updated
-                                }
-                            }
-                        )
-                    else:
-                        # Create new chat
-                        chats_collection.insert_one({
-                            "_id": conversation_id,
-                            "title": chat_title,
-                            "created_at": now,
-                            "updated_at": now,
-                            "model_name": model,
-                            "document_names": [],
-                            "message_count": 1,
-                            "is_deleted": False,
-                            "user_id": user_id
-                        })
-                    
-                    # Get next message order
-                    next_order = 1
-                    last_message = conversations_collection.find_one(
-                        {"chat_id": conversation_id},
-                        sort=[("order", -1)]
-                    )
-                    if last_message:
-                        next_order = last_message.get("order", 0) + 1
-                    
-                    # Store message in the SAME FORMAT as generate_response
-                    conversations_collection.insert_one({
-                        "_id": str(ObjectId()),
-                        "chat_id": conversation_id,
-                        "user_role": query,
-                        "assistant_role": final_response,
-                        "content_type": "text",
-                        "created_at": now,
-                        "order": next_order,
-                        "user_id": user_id
-                    })
-                    
-                    logger.info(f"Saved Bing grounding chat to Cosmos DB for conversation {conversation_id} (User: {user_id})")
-                except Exception as e:
-                    logger.error(f"Error saving Bing grounding chat to Cosmos DB: {str(e)}")
-                    # Continue processing even if DB save fails
-
-                return jsonify(result)
-               
-        except Exception as e:
-            logger.error(f"Error during Bing Grounding API call: {str(e)}")
-            return jsonify({
-                'error': f"Azure AI Project client error: {str(e)}",
-                'status': 'api_error'
-            }), 500
+        return jsonify(result)
            
     except Exception as e:
         logger.error(f"Unexpected error in Bing Grounding endpoint: {str(e)}")
@@ -1253,6 +1489,99 @@ Based on the above context, answer the following question:
             'status': 'internal_error'
         }), 500
 
+def find_user_project(project_id, user_id):
+    """Return the project if it exists and belongs to the user, otherwise None."""
+    return projects_collection.find_one({"_id": project_id, "user_id": user_id})
+
+@app.route('/api/projects/<project_id>/documents', methods=['POST'])
+@require_auth
+def upload_project_document(project_id):
+    """Extract an uploaded document and store it with the project."""
+    try:
+        user_id = request.user['id']
+
+        if not find_user_project(project_id, user_id):
+            return jsonify({'error': 'Project not found or access denied'}), 404
+
+        document_file = request.files.get('document')
+        if not document_file or not document_file.filename:
+            return jsonify({'error': 'No document provided'}), 400
+
+        document_file.seek(0, os.SEEK_END)
+        file_size_mb = document_file.tell() / (1024 * 1024)
+        document_file.seek(0)
+        if file_size_mb > MAX_DOCUMENT_SIZE_MB:
+            return jsonify({
+                'error': f'File {document_file.filename} exceeds maximum size of {MAX_DOCUMENT_SIZE_MB}MB'
+            }), 400
+
+        document_name = request.form.get('document_name') or document_file.filename
+        _, file_extension = os.path.splitext(document_file.filename)
+        document_text = document_ingestor.extract_all([(document_file.read(), file_extension)])[0]
+        if is_extraction_error(document_text):
+            return jsonify({'error': document_text}), 400
+
+        document_obj = {
+            "name": document_name,
+            "text": document_text,
+            "type": file_extension.lower(),
+            "uploaded_at": datetime.now().isoformat(),
+            "size_mb": file_size_mb
+        }
+        if not document_store.add_references([document_obj], user_id, project_id=project_id):
+            return jsonify({'error': 'Failed to store document'}), 500
+
+        return jsonify({
+            'name': document_obj['name'],
+            'type': document_obj['type'],
+            'size_mb': document_obj['size_mb'],
+            'uploaded_at': document_obj['uploaded_at'],
+            'content_hash': document_obj['content_hash']
+        })
+
+    except Exception as e:
+        logger.error(f"Error uploading project document: {str(e)}")
+        return jsonify({'error': f"Failed to upload document: {str(e)}"}), 500
+
+@app.route('/api/projects/<project_id>/documents', methods=['GET'])
+@require_auth
+def get_project_documents(project_id):
+    """List a project's stored documents without their text."""
+    try:
+        user_id = request.user['id']
+
+        if not find_user_project(project_id, user_id):
+            return jsonify({'error': 'Project not found or access denied'}), 404
+
+        documents = document_store.list_documents(project_id=project_id)
+        for doc in documents:
+            doc.pop('text')
+
+        return jsonify({'documents': documents})
+
+    except Exception as e:
+        logger.error(f"Error fetching project documents: {str(e)}")
+        return jsonify({'error': f"Failed to retrieve project documents: {str(e)}"}), 500
+
+@app.route('/api/metrics', methods=['GET'])
+@require_auth
+def get_metrics():
+    """Report runtime metrics for background maintenance and in-process caches."""
+    try:
+        return jsonify({
+            "maintenance": maintenance_scheduler.stats(),
+            "indexes": index_manager.stats(),
+            "conversation_store": conversation_store.stats(),
+            "chat_repository": chat_repository.stats(),
+            "extraction_cache": extraction_cache.stats(),
+            "grounding": grounding_client_pool.stats(),
+            "grounding_cache": grounding_cache.stats(),
+            "document_store": document_store.stats()
+        })
+    except Exception as e:
+        logger.error(f"Error fetching metrics: {str(e)}")
+        return jsonify({'error': f"Failed to retrieve metrics: {str(e)}"}), 500
+
 # Add these error handlers
 @app.errorhandler(401)
 def unauthorized_error(error):
@@ -1268,13 +1597,8 @@ def forbidden_error(error):
         'message': 'You do not have permission to access this resource'
     }), 403
 
-shared_chats_collection = db["shared_chats"]
-shared_conversations_collection = db["shared_conversations"]
-
-# Create indexes for shared collections
-shared_chats_collection.create_index([("share_id", ASCENDING)])
-shared_chats_collection.create_index([("original_chat_id", ASCENDING)])
-shared_conversations_collection.create_index([("share_id", ASCENDING), ("order", ASCENDING)])
+shared_chats_collection = lazy_collection(db, "shared_chats")
+shared_conversations_collection = lazy_collection(db, "shared_conversations")
 
 def generate_share_id(chat_id):
     """Generate a unique share ID for a chat."""
@@ -1415,8 +1739,39 @@ def get_shared_chat(share_id):
         return jsonify({'error': f"Failed to retrieve shared chat: {str(e)}"}), 500
 
 
+_background_services_started = False
+_background_services_lock = threading.Lock()
+
+def create_app():
+    """Start the background services and return the Flask app.
+
+    Importing this module only defines the app; clients connect on first use
+    and index creation runs in the background, so a worker can start serving
+    without waiting on the network. Safe to call more than once.
+    """
+    global _background_services_started
+    with _background_services_lock:
+        if not _background_services_started:
+            index_manager.start()
+            maintenance_scheduler.start()
+            chat_repository.start()
+            grounding_client_pool.warm(os.environ.get("PROJECT_CONNECTION_STRING"), os.environ.get("BING_CONNECTION_NAME"))
+            _background_services_started = True
+    return app
+
+def shutdown_app():
+    """Stop the background services and flush queued chat writes.
+
+    Called when a worker exits, after in-flight requests have finished.
+    """
+    if _background_services_started:
+        maintenance_scheduler.stop()
+    chat_repository.close()
+    document_ingestor.shutdown()
+    logger.info("Background services stopped")
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
+    create_app().run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
  
  
  
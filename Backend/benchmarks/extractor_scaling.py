@@ -0,0 +1,61 @@
+"""Check that document extraction time and memory scale linearly with size.
+
+Usage:
+    python benchmarks/extractor_scaling.py [--rows 500,1000,2000,4000]
+
+Builds Word documents whose tables have the given number of rows, extracts
+each one and reports time and peak traced memory per row. Roughly constant
+per-row figures mean linear scaling. Run from the Backend directory.
+"""
+import os
+import io
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from document_utils import extract_text_from_word
+
+def build_docx(num_rows, num_cols=6):
+    """Build a Word document with one large table and a few paragraphs."""
+    import docx
+
+    doc = docx.Document()
+    doc.add_heading("Portfolio holdings", 1)
+    for _ in range(20):
+        doc.add_paragraph("Holdings are reported at market value as of the statement date. " * 3)
+
+    table = doc.add_table(rows=num_rows, cols=num_cols)
+    for row_idx, row in enumerate(table.rows):
+        for col_idx, cell in enumerate(row.cells):
+            cell.text = f"R{row_idx}C{col_idx} 1,234.56"
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def measure(data):
+    tracemalloc.start()
+    started = time.perf_counter()
+    text = extract_text_from_word(io.BytesIO(data))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, len(text)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="500,1000,2000,4000", help="comma separated table sizes")
+    args = parser.parse_args()
+
+    print(f"{'rows':>7}{'chars':>11}{'time ms':>10}{'us/row':>9}{'peak KiB':>11}{'B/row':>8}")
+    for num_rows in (int(n) for n in args.rows.split(",")):
+        data = build_docx(num_rows)
+        elapsed, peak, chars = measure(data)
+        print(f"{num_rows:>7}{chars:>11}{elapsed * 1000:>10.1f}{elapsed * 1e6 / num_rows:>9.1f}"
+              f"{peak / 1024:>11.0f}{peak / num_rows:>8.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Load-test the gunicorn deployment against stubbed backends to pick worker and thread counts.
+
+Usage:
+    python benchmarks/load_test.py [--configs 1x8,2x16,2x32,4x32] [--requests 400]
+                                   [--concurrency 64] [--latency-ms 1500]
+
+Starts a local stub of the Azure OpenAI chat completions API that answers
+after --latency-ms, then for each WORKERSxTHREADS config boots gunicorn with
+gunicorn.conf.py and fires --requests POST /generate-response calls with
+--concurrency clients. Token validation and chat persistence are replaced in
+the worker by stubs, so the numbers reflect the serving model rather than
+Azure AD or Cosmos DB. Run from the Backend directory.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import statistics
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from startup_time import BACKEND_DIR, STUB_ENVIRONMENT
+
+def create_stubbed_app():
+    """gunicorn entry point: the real app with auth and persistence stubbed out."""
+    import app
+    import auth_middleware
+
+    auth_middleware.validate_token = lambda token: {"oid": "load-test-user", "name": "Load Test"}
+    app.chat_repository.save_turn = lambda *args, **kwargs: {"success": True, "forbidden": False}
+    return app.create_app()
+
+class StubCompletionHandler(BaseHTTPRequestHandler):
+    latency_seconds = 1.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency_seconds)
+        body = json.dumps({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-4o",
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "Stubbed response. " * 20}
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 60, "total_tokens": 160}
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_until_ready(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/login", timeout=1)
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not become ready")
+
+def send_request(port):
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}/generate-response",
+        data=json.dumps({"input_text": "How did the portfolio do this quarter?", "model_name": "gpt-4o"}).encode("utf-8"),
+        headers={"Content-Type": "application/json", "Authorization": "Bearer load-test"}
+    )
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            response.read()
+            ok = response.status == 200
+    except Exception:
+        ok = False
+    return ok, (time.perf_counter() - started) * 1000
+
+def run_config(workers, threads, stub_port, args):
+    port = free_port()
+    env = dict(
+        os.environ,
+        **STUB_ENVIRONMENT,
+        AZURE_OPENAI_ENDPOINT=f"http://127.0.0.1:{stub_port}",
+        AZURE_AD_TENANT_ID="load-test",
+        AZURE_AD_CLIENT_ID="load-test",
+        PORT=str(port),
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_THREADS=str(threads),
+        CHAT_WRITE_MODE="sync"
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--pythonpath", "benchmarks",
+         "--access-logfile", "/dev/null", "load_test:create_stubbed_app()"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_until_ready(port)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(lambda _: send_request(port), range(args.requests)))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    latencies = sorted(latency for ok, latency in results if ok)
+    errors = sum(1 for ok, _ in results if not ok)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    return {
+        "config": f"{workers}x{threads}",
+        "throughput": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) if latencies else 0,
+        "p95": p95,
+        "errors": errors
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configs", default="1x8,2x16,2x32,4x32", help="comma-separated WORKERSxTHREADS")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency-ms", type=int, default=1500, help="stub completion latency")
+    args = parser.parse_args()
+
+    StubCompletionHandler.latency_seconds = args.latency_ms / 1000
+    stub_port = free_port()
+    stub_server = ThreadingHTTPServer(("127.0.0.1", stub_port), StubCompletionHandler)
+    threading.Thread(target=stub_server.serve_forever, daemon=True).start()
+
+    print(f"{'config':<10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+    for config in args.configs.split(","):
+        workers, threads = (int(value) for value in config.lower().split("x"))
+        result = run_config(workers, threads, stub_port, args)
+        print(f"{result['config']:<10}{result['throughput']:>10.1f}{result['p50']:>10.0f}{result['p95']:>10.0f}{result['errors']:>8}")
+
+    stub_server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Compare the PyMuPDF and PyPDF2 PDF extraction engines.
+
+Usage:
+    python benchmarks/pdf_engines.py [PDF_OR_DIRECTORY ...] [--repeat N]
+
+Without arguments a small corpus of generated PDFs (10 to 500 pages) is used.
+The worker and split columns go through DocumentIngestor, as uploads do: the
+whole file in one worker process, then split into page ranges as if
+PDF_PARALLEL_PAGE_THRESHOLD were 1. Run it on the target machine's core count
+before enabling the split. Run from the Backend directory.
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# Extract whole documents in every column; set MAX_DOCUMENT_CHARS to see the app's cutoff
+os.environ.setdefault("MAX_DOCUMENT_CHARS", "0")
+
+from document_utils import extract_text_from_pdf_pymupdf, extract_text_from_pdf_pypdf2
+from extraction_cache import ExtractionCache
+from ingestion import DocumentIngestor
+
+SAMPLE_PAGE_COUNTS = [10, 50, 200, 500]
+
+def generate_sample_pdf(num_pages):
+    """Build an in-memory PDF with a few paragraphs of text on every page."""
+    import fitz
+
+    doc = fitz.open()
+    paragraph = "Groww mutual fund factsheet line with numbers 12.5% and 1,234.56 INR. " * 6
+    for page_num in range(num_pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), f"Page {page_num + 1}\n" + "\n".join([paragraph] * 8), fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def load_corpus(paths):
+    if not paths:
+        return [(f"generated-{n}p.pdf", generate_sample_pdf(n)) for n in SAMPLE_PAGE_COUNTS]
+
+    corpus = []
+    for path in paths:
+        files = sorted(glob.glob(os.path.join(path, "*.pdf"))) if os.path.isdir(path) else [path]
+        for file_path in files:
+            with open(file_path, "rb") as file:
+                corpus.append((os.path.basename(file_path), file.read()))
+    return corpus
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="PDF files or directories of PDFs")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per engine, the best time is reported")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.paths)
+
+    # An empty cache so every run extracts again
+    worker = DocumentIngestor(ExtractionCache(0), pdf_split_threshold=0)
+    split = DocumentIngestor(ExtractionCache(0), pdf_split_threshold=1)
+
+    def ingest(ingestor, data):
+        return ingestor.extract_all([(data, ".pdf")])[0]
+
+    print(f"{'document':<32}{'pages':>7}{'pypdf2 ms':>12}{'pymupdf ms':>12}{'worker ms':>11}{'split ms':>10}{'speedup':>9}")
+    for name, data in corpus:
+        pypdf2_time, _ = best_of(args.repeat, extract_text_from_pdf_pypdf2, data)
+        pymupdf_time, text = best_of(args.repeat, extract_text_from_pdf_pymupdf, data)
+        worker_time, _ = best_of(args.repeat, ingest, worker, data)
+        split_time, _ = best_of(args.repeat, ingest, split, data)
+        pages = text.split(" pages", 1)[0].rsplit(" ", 1)[-1]
+        print(f"{name[:31]:<32}{pages:>7}{pypdf2_time * 1000:>12.1f}{pymupdf_time * 1000:>12.1f}"
+              f"{worker_time * 1000:>11.1f}{split_time * 1000:>10.1f}{pypdf2_time / pymupdf_time:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Measure import-to-ready time of the Flask app.
+
+Usage:
+    python benchmarks/startup_time.py [--runs 5] [--eager]
+
+Each run starts a fresh interpreter that imports app, calls create_app and
+serves GET /login through the test client. Every external service points at
+a local address that nothing listens on, so any time spent is the app's own
+startup work rather than network latency. --eager additionally builds the
+Mongo and OpenAI clients before the first request, to show what lazy
+initialization saves. Run from the Backend directory.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+STUB_ENVIRONMENT = {
+    "COSMOS_DB_URL": "mongodb://user:<password>@127.0.0.1:27999/?serverSelectionTimeoutMS=500",
+    "COSMOS_DB_PASSWORD": "stub",
+    "COSMOS_DB_NAME": "startup_benchmark",
+    "AZURE_OPENAI_ENDPOINT": "http://127.0.0.1:9",
+    "AZURE_OPENAI_API_KEY": "stub",
+    "AZURE_OPENAI_API_VERSION": "2024-12-01-preview",
+    "AZURE_DALLE_ENDPOINT": "http://127.0.0.1:9",
+    "AZURE_DALLE_API_KEY": "stub",
+    "DALLE_API_VERSION": "2024-02-01",
+    "MAX_CONVERSATION_HISTORY": "20",
+    "CONVERSATION_EXPIRY_HOURS": "24",
+    "MAX_DOCUMENTS_PER_CONVERSATION": "10",
+    "MAX_DOCUMENT_SIZE_MB": "20",
+    "INDEX_VERIFY_QUERY_PLANS": "false"
+}
+
+CHILD_SCRIPT = """
+import time, json
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+if EAGER:
+    app.mongo_client.get()
+    app.text_client.get()
+flask_app = app.create_app()
+created = time.perf_counter()
+response = flask_app.test_client().get('/login')
+ready = time.perf_counter()
+print(json.dumps({
+    "status": response.status_code,
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (ready - created) * 1000,
+    "total_ms": (ready - started) * 1000
+}))
+"""
+
+def run_once(eager):
+    env = dict(os.environ, **STUB_ENVIRONMENT)
+    script = f"EAGER = {eager}\n" + CHILD_SCRIPT
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=120
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--eager", action="store_true", help="build the Mongo and OpenAI clients before serving")
+    args = parser.parse_args()
+
+    results = [run_once(args.eager) for _ in range(args.runs)]
+    print(f"{'phase':<18}{'median ms':>12}{'max ms':>12}")
+    for phase in ("import_ms", "create_app_ms", "first_request_ms", "total_ms"):
+        values = [result[phase] for result in results]
+        print(f"{phase:<18}{statistics.median(values):>12.1f}{max(values):>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import os
+import time
+import threading
+import logging
+from datetime import datetime
+from bson import ObjectId
+from pymongo import DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from title import sanitize_title
+from write_behind import WriteBehindQueue
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Chat persistence configuration
+# sync: write the chat and message before responding
+# batched: upsert the chat before responding, queue the message insert
+# write_behind: queue the whole turn and respond immediately
+CHAT_WRITE_MODE = os.environ.get("CHAT_WRITE_MODE", "sync").lower()
+
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 2)
+
+class ChatRepository:
+    """Persists chats and their user/assistant message pairs.
+
+    Every endpoint that stores a chat turn goes through save_turn, which costs
+    one chat upsert and one message insert. In the batched and write_behind
+    modes part or all of that work is handed to a WriteBehindQueue.
+    """
+
+    def __init__(self, chats_collection, conversations_collection, write_mode=CHAT_WRITE_MODE,
+                 on_chat_created=None):
+        """on_chat_created(user_id), if given, is called whenever a turn creates a new chat."""
+        self.chats_collection = chats_collection
+        self.conversations_collection = conversations_collection
+        self.write_mode = write_mode
+        self.on_chat_created = on_chat_created
+        self.write_queue = None
+        if write_mode in ("batched", "write_behind"):
+            self.write_queue = WriteBehindQueue(conversations_collection, self.reserve_message_order)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "turns_saved": 0,
+            "turns_forbidden": 0,
+            "errors": 0,
+            "chat_upsert_ms_total": 0.0,
+            "message_insert_ms_total": 0.0
+        }
+
+    def reserve_message_order(self, chat_id, user_id, model_name, chat_title, document_names=None, count=1):
+        """Upsert the chat document and atomically reserve the next message order(s).
+
+        The chat's message_count doubles as its message sequence, so bumping it
+        with $inc in a single find_one_and_update both records the turn and
+        hands back an order no concurrent turn can share. Reserving several
+        orders at once returns the last of them. Returns None if the chat
+        belongs to another user.
+
+        A freshly inserted chat comes back with created_at equal to updated_at,
+        which is how new chats are told apart for on_chat_created.
+        """
+        now = datetime.now()
+
+        update_fields = {
+            "updated_at": now,
+            "model_name": model_name,
+            "user_id": user_id  # Update user_id if not set
+        }
+        insert_fields = {
+            "title": chat_title,
+            "created_at": now,
+            "is_deleted": False
+        }
+        if document_names is None:
+            insert_fields["document_names"] = []
+        else:
+            update_fields["document_names"] = document_names
+
+        # Two turns racing to create the same chat collide on _id; the retry then
+        # matches the chat the other turn created
+        for attempt in range(2):
+            try:
+                chat = self.chats_collection.find_one_and_update(
+                    # Legacy chats may have no user_id, match those as well
+                    {"_id": chat_id, "user_id": {"$in": [user_id, None]}},
+                    {
+                        "$set": update_fields,
+                        "$setOnInsert": insert_fields,
+                        "$inc": {"message_count": count}
+                    },
+                    projection={"message_count": 1, "created_at": 1, "updated_at": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                if self.on_chat_created and chat.get("created_at") == chat.get("updated_at"):
+                    self.on_chat_created(user_id)
+                return chat["message_count"]
+            except DuplicateKeyError:
+                if attempt:
+                    # The chat exists but is owned by someone else
+                    return None
+
+    def is_chat_owner(self, chat_id, user_id):
+        """Return True unless the chat exists and belongs to another user."""
+        chat = self.chats_collection.find_one({"_id": chat_id}, {"user_id": 1})
+        return chat is None or chat.get("user_id") in (user_id, None)
+
+    def save_turn(self, chat_id, user_id, model_name, input_text, response_text, document_names=None):
+        """Persist a chat and its latest user/assistant message pair.
+
+        Returns a dict with "success", "forbidden" (the chat belongs to another
+        user), the message "order" and per-operation "timings" in milliseconds.
+        Database errors are logged and reported rather than raised so the
+        response can still reach the user.
+        """
+        started = time.perf_counter()
+        timings = {}
+
+        try:
+            # Get chat title from first message or use sanitized input text
+            chat_title = sanitize_title(input_text)
+
+            message = {
+                "_id": str(ObjectId()),
+                "chat_id": chat_id,
+                "user_role": input_text,
+                "assistant_role": response_text,
+                "content_type": "text",
+                "created_at": datetime.now(),
+                "user_id": user_id  # Store the OID
+            }
+
+            if self.write_mode == "write_behind":
+                # The queued reservation runs after the response, so ownership is checked here
+                if not self.is_chat_owner(chat_id, user_id):
+                    timings["total_ms"] = _elapsed_ms(started)
+                    logger.warning(f"User {user_id} attempted to access chat {chat_id} owned by another user")
+                    self._record(timings, forbidden=True)
+                    return {"success": False, "forbidden": True, "timings": timings}
+                if self.write_queue.enqueue_turn(chat_id, user_id, model_name, chat_title, document_names, message):
+                    timings["enqueue_ms"] = _elapsed_ms(started)
+                    timings["total_ms"] = timings["enqueue_ms"]
+                    self._record(timings)
+                    return {"success": True, "forbidden": False, "queued": True, "order": None, "timings": timings}
+                logger.warning("Write-behind queue is full or not running, saving chat turn synchronously")
+
+            next_order = self.reserve_message_order(chat_id, user_id, model_name, chat_title, document_names)
+            timings["chat_upsert_ms"] = _elapsed_ms(started)
+
+            if next_order is None:
+                logger.warning(f"User {user_id} attempted to access chat {chat_id} owned by another user")
+                self._record(timings, forbidden=True)
+                return {"success": False, "forbidden": True, "timings": timings}
+
+            message["order"] = next_order
+
+            insert_started = time.perf_counter()
+            if not (self.write_mode == "batched" and self.write_queue.enqueue_message(message)):
+                self.conversations_collection.insert_one(message)
+            timings["message_insert_ms"] = _elapsed_ms(insert_started)
+            timings["total_ms"] = _elapsed_ms(started)
+
+            self._record(timings)
+            logger.info(f"Saved chat and message to Cosmos DB for conversation {chat_id} (User: {user_id}) in {timings['total_ms']}ms")
+            return {"success": True, "forbidden": False, "queued": False, "order": next_order, "timings": timings}
+
+        except Exception as e:
+            logger.error(f"Error saving chat data to Cosmos DB: {str(e)}")
+            self._record(timings, error=True)
+            return {"success": False, "forbidden": False, "error": str(e), "timings": timings}
+
+    def load_turns(self, chat_id, limit):
+        """Load the latest `limit` user/assistant message pairs of a chat, oldest first.
+
+        Only the fields needed to rebuild the conversation are fetched, newest
+        first so the (chat_id, order) index satisfies both the sort and the
+        limit. Older turns are never needed: they would be trimmed from the
+        prompt's history anyway.
+        """
+        turns = list(self.conversations_collection.find(
+            {"chat_id": chat_id},
+            {"_id": 0, "user_role": 1, "assistant_role": 1}
+        ).sort("order", DESCENDING).limit(limit))
+        turns.reverse()
+        return turns
+
+    def _record(self, timings, forbidden=False, error=False):
+        with self._stats_lock:
+            if error:
+                self._stats["errors"] += 1
+            elif forbidden:
+                self._stats["turns_forbidden"] += 1
+            else:
+                self._stats["turns_saved"] += 1
+            self._stats["chat_upsert_ms_total"] += timings.get("chat_upsert_ms", 0)
+            self._stats["message_insert_ms_total"] += timings.get("message_insert_ms", 0)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        saved = stats["turns_saved"] or 1
+        stats["avg_chat_upsert_ms"] = round(stats["chat_upsert_ms_total"] / saved, 2)
+        stats["avg_message_insert_ms"] = round(stats["message_insert_ms_total"] / saved, 2)
+        stats["write_mode"] = self.write_mode
+        if self.write_queue:
+            stats["write_queue"] = self.write_queue.stats()
+        return stats
+
+    def start(self):
+        """Start the write-behind worker, if the write mode uses one."""
+        if self.write_queue:
+            self.write_queue.start()
+
+    def close(self):
+        """Flush any queued writes (used on shutdown)."""
+        if self.write_queue:
+            self.write_queue.close()
@@ -0,0 +1,45 @@
+import time
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class LazyClient:
+    """Proxy that builds a client on first use instead of at import time.
+
+    Attribute access and indexing are forwarded to the real client, so a
+    LazyClient can stand in wherever the client itself was used. Construction
+    is guarded by a lock, so concurrent first requests build it only once.
+    """
+
+    def __init__(self, factory, name):
+        self._factory = factory
+        self._name = name
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    started = time.perf_counter()
+                    self._client = self._factory()
+                    logger.info(f"Initialized {self._name} client in {(time.perf_counter() - started) * 1000:.0f}ms")
+                client = self._client
+        return client
+
+    @property
+    def initialized(self):
+        return self._client is not None
+
+    def __getattr__(self, attribute):
+        return getattr(self.get(), attribute)
+
+    def __getitem__(self, key):
+        return self.get()[key]
+
+def lazy_collection(database, name):
+    """A collection of a lazily connected database, itself resolved on first use."""
+    return LazyClient(lambda: database[name], f"{name} collection")
@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Conversation store configuration
+CONVERSATION_STORE_BACKENDS = ("memory", "redis")
+
+def read_store_backend():
+    """Read CONVERSATION_STORE_BACKEND, normalized; unknown values are rejected."""
+    backend = os.environ.get("CONVERSATION_STORE_BACKEND", "memory").strip().lower()
+    if backend not in CONVERSATION_STORE_BACKENDS:
+        raise ValueError(f"Unknown CONVERSATION_STORE_BACKEND {backend!r}, expected one of: {', '.join(CONVERSATION_STORE_BACKENDS)}")
+    return backend
+
+CONVERSATION_STORE_BACKEND = read_store_backend()
+CONVERSATION_STORE_MAX_MB = int(os.environ.get("CONVERSATION_STORE_MAX_MB", 256))
+CONVERSATION_STORE_REDIS_URL = os.environ.get("CONVERSATION_STORE_REDIS_URL", "redis://localhost:6379/0")
+CONVERSATION_STORE_KEY_PREFIX = os.environ.get("CONVERSATION_STORE_KEY_PREFIX", "growwgpt:conversation:")
+
+# Large context fields the Redis store keeps under keys of their own
+REDIS_SEPARATE_FIELDS = ("documents", "document_index")
+# Conversations whose separately stored fields are remembered per process
+REDIS_TRACKED_CONVERSATIONS = 10000
+
+def estimate_context_size(value):
+    """Roughly estimate the memory footprint of a conversation context in bytes.
+
+    Only strings contribute their length; containers add a small fixed overhead.
+    This is cheap enough to run on every write and tracks document text, which
+    is what dominates real contexts.
+    """
+    if isinstance(value, str):
+        return len(value) + 50
+    if isinstance(value, dict):
+        return 64 + sum(estimate_context_size(k) + estimate_context_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(estimate_context_size(v) for v in value)
+    return 32
+
+def field_digest(field, value):
+    """Cheap fingerprint of a separately stored context field.
+
+    Documents are only ever appended (and hydrated or given a content hash in
+    place), and the document index only grows with them, so these change
+    whenever the serialized field would.
+    """
+    if field == "documents":
+        return tuple(
+            (doc.get("name"), str(doc.get("uploaded_at")), doc.get("content_hash"), len(doc["text"]) if doc.get("text") else None)
+            for doc in value
+        )
+    return (value.get("version"), value.get("documents_indexed"), len(value.get("chunks", [])))
+
+class InMemoryConversationStore:
+    """Process-local conversation store with a byte budget and LRU/TTL eviction.
+
+    Entries are kept in an OrderedDict in least-recently-used order, so both
+    eviction and expiry only ever look at the head of the dict: expiry stops at
+    the first entry that is still fresh, which keeps it O(1) amortized instead
+    of scanning every conversation.
+    """
+
+    def __init__(self, max_bytes, ttl_seconds):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # conversation_id -> (context, size, last_access)
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, conversation_id):
+        """Return the context for a conversation and mark it as recently used."""
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                return None
+
+            context, size, last_access = entry
+            now = time.time()
+            if now - last_access > self.ttl_seconds:
+                self._remove(conversation_id)
+                self._expirations += 1
+                return None
+
+            context["last_accessed"] = datetime.now()
+            self._entries[conversation_id] = (context, size, now)
+            self._entries.move_to_end(conversation_id)
+            return context
+
+    def put(self, conversation_id, context):
+        """Store (or re-store after mutation) a conversation context."""
+        size = estimate_context_size(context)
+        with self._lock:
+            if conversation_id in self._entries:
+                self._remove(conversation_id)
+
+            context["last_accessed"] = datetime.now()
+            self._entries[conversation_id] = (context, size, time.time())
+            self._total_bytes += size
+
+            if size > self.max_bytes:
+                logger.warning(f"Conversation {conversation_id} alone exceeds the store budget ({size} bytes)")
+
+            # Evict least recently used conversations until we are back under budget,
+            # but never the one we have just written
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                oldest_id = next(iter(self._entries))
+                self._remove(oldest_id)
+                self._evictions += 1
+
+    def delete(self, conversation_id):
+        with self._lock:
+            if conversation_id in self._entries:
+                self._remove(conversation_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def expire(self):
+        """Drop expired conversations from the head of the LRU order."""
+        expired = 0
+        threshold = time.time() - self.ttl_seconds
+        with self._lock:
+            while self._entries:
+                oldest_id, (_, _, last_access) = next(iter(self._entries.items()))
+                if last_access >= threshold:
+                    break
+                self._remove(oldest_id)
+                expired += 1
+            self._expirations += expired
+        return expired
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "conversations": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions,
+                "expirations": self._expirations
+            }
+
+    def _remove(self, conversation_id):
+        _, size, _ = self._entries.pop(conversation_id)
+        self._total_bytes -= size
+
+    def __contains__(self, conversation_id):
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            return entry is not None and time.time() - entry[2] <= self.ttl_seconds
+
+class RedisConversationStore:
+    """Conversation store shared between worker processes through Redis.
+
+    Works against any Redis-compatible server. Expiry is handled by per-key
+    TTLs that are refreshed on every read, and LRU eviction under the memory
+    budget is delegated to the server (maxmemory with allkeys-lru). Contexts
+    larger than the budget are refused so one conversation cannot flush the
+    whole cache.
+
+    Document text and the document index are stored under keys of their own
+    and only rewritten when they changed since this process last read or
+    wrote them, so an ordinary turn only reserializes the messages.
+    """
+
+    def __init__(self, url, max_bytes, ttl_seconds, key_prefix=CONVERSATION_STORE_KEY_PREFIX):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("redis library is not installed. Install with: pip install redis")
+
+        self.max_bytes = max_bytes
+        self.ttl_seconds = int(ttl_seconds)
+        self.key_prefix = key_prefix
+        self._client = redis.Redis.from_url(url)
+        self._rejected = 0
+        self._field_writes = 0
+        self._field_writes_skipped = 0
+        self._stored = OrderedDict()  # conversation_id -> {field: (digest, size)} as last read or written
+        self._stored_lock = threading.Lock()
+
+    def _key(self, conversation_id, field=None):
+        key = f"{self.key_prefix}{conversation_id}"
+        return f"{key}:{field}" if field else key
+
+    def get(self, conversation_id):
+        pipe = self._client.pipeline()
+        pipe.getex(self._key(conversation_id), ex=self.ttl_seconds)
+        for field in REDIS_SEPARATE_FIELDS:
+            pipe.getex(self._key(conversation_id, field), ex=self.ttl_seconds)
+        payload, *field_payloads = pipe.execute()
+        if payload is None:
+            return None
+
+        context = json.loads(payload)
+        stored_fields = context.pop("_stored_fields", [])
+        stored = {}
+        for field, field_payload in zip(REDIS_SEPARATE_FIELDS, field_payloads):
+            if field not in stored_fields:
+                continue
+            if field_payload is None:
+                # Evicted on its own; treat the whole context as gone so it is reloaded
+                self._forget(conversation_id)
+                return None
+            context[field] = json.loads(field_payload)
+            stored[field] = (field_digest(field, context[field]), len(field_payload))
+        self._remember(conversation_id, stored)
+        context["last_accessed"] = datetime.now()
+        return context
+
+    def put(self, conversation_id, context):
+        context["last_accessed"] = datetime.now()
+        base = {key: value for key, value in context.items() if key not in REDIS_SEPARATE_FIELDS}
+        previous = self._recall(conversation_id)
+        stored, changed = {}, {}
+        for field in REDIS_SEPARATE_FIELDS:
+            value = context.get(field)
+            if value is None:
+                continue
+            digest = field_digest(field, value)
+            if field in previous and previous[field][0] == digest:
+                stored[field] = previous[field]
+                continue
+            changed[field] = json.dumps(value, default=str)
+            stored[field] = (digest, len(changed[field]))
+
+        base["_stored_fields"] = list(stored)
+        payload = json.dumps(base, default=str)
+        size = len(payload) + sum(field_size for _, field_size in stored.values())
+        if size > self.max_bytes:
+            self._rejected += 1
+            logger.warning(f"Conversation {conversation_id} exceeds the store budget ({size} bytes), not stored")
+            return
+
+        pipe = self._client.pipeline()
+        pipe.set(self._key(conversation_id), payload, ex=self.ttl_seconds)
+        unchanged = [field for field in stored if field not in changed]
+        for field, field_payload in changed.items():
+            pipe.set(self._key(conversation_id, field), field_payload, ex=self.ttl_seconds)
+        for field in unchanged:
+            pipe.expire(self._key(conversation_id, field), self.ttl_seconds)
+        refreshed = pipe.execute()[1 + len(changed):]
+
+        # A field evicted since it was read is written out again after all
+        missing = [field for field, exists in zip(unchanged, refreshed) if not exists]
+        for field in missing:
+            self._client.set(self._key(conversation_id, field), json.dumps(context[field], default=str), ex=self.ttl_seconds)
+        self._field_writes += len(changed) + len(missing)
+        self._field_writes_skipped += len(unchanged) - len(missing)
+        self._remember(conversation_id, stored)
+
+    def _remember(self, conversation_id, stored):
+        with self._stored_lock:
+            self._stored.pop(conversation_id, None)
+            self._stored[conversation_id] = stored
+            while len(self._stored) > REDIS_TRACKED_CONVERSATIONS:
+                self._stored.popitem(last=False)
+
+    def _recall(self, conversation_id):
+        with self._stored_lock:
+            return self._stored.get(conversation_id, {})
+
+    def _forget(self, conversation_id):
+        with self._stored_lock:
+            self._stored.pop(conversation_id, None)
+
+    def delete(self, conversation_id):
+        self._forget(conversation_id)
+        self._client.delete(self._key(conversation_id), *(self._key(conversation_id, field) for field in REDIS_SEPARATE_FIELDS))
+
+    def clear(self):
+        with self._stored_lock:
+            self._stored.clear()
+        for key in self._client.scan_iter(match=f"{self.key_prefix}*"):
+            self._client.delete(key)
+
+    def expire(self):
+        # Redis expires keys on its own
+        return 0
+
+    def stats(self):
+        info = self._client.info("memory")
+        return {
+            "backend": "redis",
+            "bytes": info.get("used_memory"),
+            "max_bytes": self.max_bytes,
+            "evictions": self._client.info("stats").get("evicted_keys"),
+            "rejected": self._rejected,
+            "field_writes": self._field_writes,
+            "field_writes_skipped": self._field_writes_skipped
+        }
+
+    def __contains__(self, conversation_id):
+        return bool(self._client.exists(self._key(conversation_id)))
+
+def create_conversation_store(ttl_seconds):
+    """Create the conversation store selected by CONVERSATION_STORE_BACKEND (validated on import)."""
+    max_bytes = CONVERSATION_STORE_MAX_MB * 1024 * 1024
+
+    if CONVERSATION_STORE_BACKEND == "redis":
+        logger.info("Using Redis conversation store")
+        return RedisConversationStore(CONVERSATION_STORE_REDIS_URL, max_bytes, ttl_seconds)
+
+    return InMemoryConversationStore(max_bytes, ttl_seconds)
@@ -0,0 +1,171 @@
+import os
+import re
+import math
+import heapq
+import logging
+
+from document_utils import is_extraction_error
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Document retrieval configuration
+DOCUMENT_RETRIEVAL_TOP_K = int(os.environ.get("DOCUMENT_RETRIEVAL_TOP_K", 8))  # 0 sends full document text
+DOCUMENT_CHUNK_CHARS = int(os.environ.get("DOCUMENT_CHUNK_CHARS", 2000))
+DOCUMENT_CHUNK_OVERLAP_CHARS = int(os.environ.get("DOCUMENT_CHUNK_OVERLAP_CHARS", 200))
+# Documents this small in total are cheaper to send whole than to retrieve from
+DOCUMENT_RETRIEVAL_MIN_CHARS = int(os.environ.get("DOCUMENT_RETRIEVAL_MIN_CHARS", 20000))
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+INDEX_VERSION = 1
+
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from had has have how i if in into is it its
+me my not of on or our so than that the their them then there these they this to was we
+were what when where which who why will with you your please about
+""".split())
+
+def tokenize(text):
+    """Lowercase word tokens with stopwords and single characters removed."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) > 1 and token not in STOPWORDS]
+
+def split_into_chunks(text, chunk_chars=DOCUMENT_CHUNK_CHARS, overlap_chars=DOCUMENT_CHUNK_OVERLAP_CHARS):
+    """Yield (start, end) offsets of overlapping chunks, preferring paragraph or line breaks as boundaries."""
+    length = len(text)
+    start = 0
+    while start < length:
+        end = min(start + chunk_chars, length)
+        if end < length:
+            # Back up to the last break in the second half of the chunk, if there is one
+            for separator in ("\n\n", "\n", ". "):
+                cut = text.rfind(separator, start + chunk_chars // 2, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        yield start, end
+        if end >= length:
+            break
+        start = max(end - overlap_chars, start + 1)
+
+def new_document_index():
+    """An empty index. It only holds plain dicts and lists so it can live in the conversation context."""
+    return {
+        "version": INDEX_VERSION,
+        "documents_indexed": 0,
+        "chunks": [],  # {"doc", "start", "end", "tf", "length"}
+        "df": {},  # term -> number of chunks containing it
+        "total_length": 0
+    }
+
+def update_document_index(index, documents):
+    """Index any documents added since the last call and return the index.
+
+    Documents are only ever appended to a conversation, so indexing resumes
+    from documents_indexed; the index is rebuilt if the list was reset.
+    """
+    if not index or index.get("version") != INDEX_VERSION or index["documents_indexed"] > len(documents):
+        index = new_document_index()
+
+    for doc_idx in range(index["documents_indexed"], len(documents)):
+        text = documents[doc_idx]["text"]
+        if not text or is_extraction_error(text):
+            continue
+        for start, end in split_into_chunks(text):
+            terms = tokenize(text[start:end])
+            if not terms:
+                continue
+            tf = {}
+            for term in terms:
+                tf[term] = tf.get(term, 0) + 1
+            for term in tf:
+                index["df"][term] = index["df"].get(term, 0) + 1
+            index["chunks"].append({"doc": doc_idx, "start": start, "end": end, "tf": tf, "length": len(terms)})
+            index["total_length"] += len(terms)
+
+    if index["documents_indexed"] < len(documents):
+        logger.info(f"Indexed {len(documents) - index['documents_indexed']} document(s), {len(index['chunks'])} chunks in total")
+    index["documents_indexed"] = len(documents)
+    return index
+
+def search_document_index(index, query, top_k=DOCUMENT_RETRIEVAL_TOP_K):
+    """Rank chunks against the query with BM25; returns (score, chunk) pairs, best first."""
+    chunks = index["chunks"]
+    if not chunks:
+        return []
+    query_terms = set(tokenize(query))
+    num_chunks = len(chunks)
+    average_length = index["total_length"] / num_chunks
+
+    idf = {}
+    for term in query_terms:
+        df = index["df"].get(term, 0)
+        if df:
+            idf[term] = math.log(1 + (num_chunks - df + 0.5) / (df + 0.5))
+    if not idf:
+        return []
+
+    scored = []
+    for position, chunk in enumerate(chunks):
+        tf = chunk["tf"]
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * chunk["length"] / average_length)
+        score = 0.0
+        for term, weight in idf.items():
+            count = tf.get(term)
+            if count:
+                score += weight * count * (BM25_K1 + 1) / (count + norm)
+        if score > 0:
+            scored.append((score, position))
+
+    return [(score, chunks[position]) for score, position in heapq.nlargest(top_k, scored)]
+
+def leading_chunks(index, top_k):
+    """The opening chunks of every document, taken in turn; used when the query matches nothing."""
+    by_document = {}
+    for chunk in index["chunks"]:
+        by_document.setdefault(chunk["doc"], []).append(chunk)
+    selected = []
+    depth = 0
+    while len(selected) < top_k and any(depth < len(doc_chunks) for doc_chunks in by_document.values()):
+        for doc_chunks in by_document.values():
+            if depth < len(doc_chunks) and len(selected) < top_k:
+                selected.append(doc_chunks[depth])
+        depth += 1
+    return selected
+
+def retrieve_document_passages(index, documents, query, top_k=DOCUMENT_RETRIEVAL_TOP_K):
+    """Return stand-ins for the documents holding only the passages relevant to the query.
+
+    Each returned document keeps its name and type; its text is the top-k
+    chunks in their original order. Small document sets and a disabled
+    top_k return the documents unchanged.
+    """
+    if not top_k or sum(len(doc["text"]) for doc in documents) <= DOCUMENT_RETRIEVAL_MIN_CHARS:
+        return documents
+
+    chunks = [chunk for _, chunk in search_document_index(index, query, top_k)]
+    if not chunks:
+        chunks = leading_chunks(index, top_k)
+
+    passages = {}
+    for chunk in sorted(chunks, key=lambda c: (c["doc"], c["start"])):
+        doc = documents[chunk["doc"]]
+        passages.setdefault(chunk["doc"], []).append(doc["text"][chunk["start"]:chunk["end"]].strip())
+
+    selected = []
+    for doc_idx, doc in enumerate(documents):
+        if doc_idx in passages:
+            selected.append({
+                "name": doc["name"],
+                "type": doc["type"],
+                "text": "\n[...]\n".join(passages[doc_idx])
+            })
+        elif is_extraction_error(doc["text"]) or len(doc["text"]) <= DOCUMENT_CHUNK_CHARS:
+            # Errors and tiny documents cost little and tell the model what it was given
+            selected.append(doc)
+
+    logger.info(f"Retrieved {len(chunks)} of {len(index['chunks'])} chunks from {len(passages)} document(s)")
+    return selected
@@ -0,0 +1,266 @@
+import os
+import hashlib
+import threading
+import logging
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ASCENDING, InsertOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from document_utils import is_extraction_error
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Document store configuration
+# Cosmos DB caps documents at 2MB; 256K characters stays below that even for 4-byte UTF-8
+DOCUMENT_STORE_CHUNK_CHARS = int(os.environ.get("DOCUMENT_STORE_CHUNK_CHARS", 256 * 1024))
+# Text nobody references is kept this long in case the same document is uploaded again
+DOCUMENT_GC_GRACE_HOURS = int(os.environ.get("DOCUMENT_GC_GRACE_HOURS", 24))
+DOCUMENT_GC_BATCH_SIZE = int(os.environ.get("DOCUMENT_GC_BATCH_SIZE", 500))
+
+MISSING_DOCUMENT_TEXT = "Error extracting document text: the stored document is no longer available"
+
+def document_content_hash(text):
+    """SHA-256 of a document's extracted text, used as its storage key."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class DocumentStore:
+    """Stores extracted document text once per content hash and tracks who references it.
+
+    Text is split into chunks so large documents fit the per-document size
+    limit. The contents document is only written after all of its chunks, so
+    its presence marks the text as complete. Chats and projects point at the
+    text through reference documents carrying the name and upload metadata,
+    which lets a reloaded conversation list its documents without reading
+    their text until a prompt needs it.
+
+    Removing the last reference to a text only marks it unreferenced;
+    collect_garbage deletes it once it has stayed that way for a grace period.
+    Only the text is stored: the BM25 retrieval index is rebuilt from it the
+    first time a reloaded conversation needs passages.
+    """
+
+    def __init__(self, contents_collection, chunks_collection, references_collection,
+                 chunk_chars=DOCUMENT_STORE_CHUNK_CHARS):
+        self.contents_collection = contents_collection
+        self.chunks_collection = chunks_collection
+        self.references_collection = references_collection
+        self.chunk_chars = chunk_chars
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "texts_stored": 0,
+            "texts_deduplicated": 0,
+            "texts_loaded": 0,
+            "texts_missing": 0,
+            "references_removed": 0,
+            "texts_collected": 0,
+            "errors": 0
+        }
+
+    def save_text(self, text):
+        """Store text under its content hash unless it is already there; returns the hash."""
+        content_hash = document_content_hash(text)
+        # Referencing the text again takes it off the garbage collector's list
+        if self.contents_collection.find_one_and_update({"_id": content_hash}, {"$unset": {"unreferenced_at": ""}}, {"_id": 1}):
+            self._bump("texts_deduplicated")
+            return content_hash
+
+        chunks = [
+            InsertOne({"_id": f"{content_hash}:{seq}", "content_hash": content_hash, "seq": seq, "text": text[start:start + self.chunk_chars]})
+            for seq, start in enumerate(range(0, len(text), self.chunk_chars) or [0])
+        ]
+        try:
+            self.chunks_collection.bulk_write(chunks, ordered=False)
+        except BulkWriteError as e:
+            # Chunks left by an earlier or concurrent save of the same text are identical
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+
+        try:
+            self.contents_collection.insert_one({
+                "_id": content_hash,
+                "char_count": len(text),
+                "chunk_count": len(chunks),
+                "created_at": datetime.now()
+            })
+        except DuplicateKeyError:
+            pass
+        self._bump("texts_stored")
+        return content_hash
+
+    def load_texts(self, content_hashes):
+        """Load the text for several content hashes with one query; missing ones are left out."""
+        content_hashes = list(set(content_hashes))
+        complete = {
+            content["_id"]: content["chunk_count"]
+            for content in self.contents_collection.find({"_id": {"$in": content_hashes}}, {"chunk_count": 1})
+        }
+        if not complete:
+            return {}
+
+        parts = {}
+        for chunk in self.chunks_collection.find({"content_hash": {"$in": list(complete)}}).sort([("content_hash", ASCENDING), ("seq", ASCENDING)]):
+            parts.setdefault(chunk["content_hash"], []).append(chunk["text"])
+        return {
+            content_hash: "".join(parts[content_hash])
+            for content_hash, chunk_count in complete.items()
+            if len(parts.get(content_hash, [])) == chunk_count
+        }
+
+    def add_references(self, documents, user_id, chat_id=None, project_id=None):
+        """Persist documents' text and reference them from a chat and/or project.
+
+        Sets "content_hash" on each stored document. Extraction errors are not
+        stored. Errors are logged rather than raised since the turn has already
+        been answered. Returns the number of documents persisted.
+        """
+        references = []
+        for doc in documents:
+            if not doc["text"] or is_extraction_error(doc["text"]):
+                continue
+            try:
+                doc["content_hash"] = self.save_text(doc["text"])
+            except Exception as e:
+                logger.error(f"Error storing document {doc['name']}: {str(e)}")
+                self._bump("errors")
+                continue
+            references.append({
+                "_id": str(ObjectId()),
+                "content_hash": doc["content_hash"],
+                "chat_id": chat_id,
+                "project_id": project_id,
+                "user_id": user_id,
+                "name": doc["name"],
+                "type": doc["type"],
+                "size_mb": doc["size_mb"],
+                "uploaded_at": doc["uploaded_at"],
+                "created_at": datetime.now()
+            })
+
+        if not references:
+            return 0
+        try:
+            self.references_collection.insert_many(references)
+        except Exception as e:
+            logger.error(f"Error storing document references: {str(e)}")
+            self._bump("errors")
+            return 0
+        logger.info(f"Stored {len(references)} document(s) for chat {chat_id} / project {project_id}")
+        return len(references)
+
+    def remove_references(self, chat_id=None, project_id=None, user_id=None, all_chats=False):
+        """Drop the document references of a chat, a project or (all_chats) every chat.
+
+        Text no longer referenced by anything is marked for collect_garbage.
+        Errors are logged rather than raised since the chat or project itself
+        is already gone. Returns the number of references removed.
+        """
+        if all_chats:
+            query = {"chat_id": {"$ne": None}}
+        elif chat_id:
+            query = {"chat_id": chat_id}
+        elif project_id:
+            query = {"project_id": project_id}
+        else:
+            raise ValueError("remove_references needs a chat_id, a project_id or all_chats")
+        if user_id:
+            query["user_id"] = user_id
+
+        try:
+            content_hashes = self.references_collection.distinct("content_hash", query)
+            removed = self.references_collection.delete_many(query).deleted_count
+            if content_hashes:
+                still_referenced = set(self.references_collection.distinct("content_hash", {"content_hash": {"$in": content_hashes}}))
+                unreferenced = [content_hash for content_hash in content_hashes if content_hash not in still_referenced]
+                if unreferenced:
+                    self.contents_collection.update_many(
+                        {"_id": {"$in": unreferenced}, "unreferenced_at": {"$exists": False}},
+                        {"$set": {"unreferenced_at": datetime.now()}}
+                    )
+        except Exception as e:
+            logger.error(f"Error removing document references for chat {chat_id} / project {project_id}: {str(e)}")
+            self._bump("errors")
+            return 0
+        self._bump("references_removed", removed)
+        return removed
+
+    def collect_garbage(self, grace_hours=DOCUMENT_GC_GRACE_HOURS, batch_size=DOCUMENT_GC_BATCH_SIZE):
+        """Delete text that has been unreferenced for longer than grace_hours; returns how many were deleted.
+
+        Each candidate is checked for references again first, since a
+        reference may have been added after it was marked.
+        """
+        threshold = datetime.now() - timedelta(hours=grace_hours)
+        candidates = [
+            content["_id"]
+            for content in self.contents_collection.find({"unreferenced_at": {"$lt": threshold}}, {"_id": 1}).limit(batch_size)
+        ]
+        collected = 0
+        for content_hash in candidates:
+            if self.references_collection.find_one({"content_hash": content_hash}, {"_id": 1}):
+                self.contents_collection.update_one({"_id": content_hash}, {"$unset": {"unreferenced_at": ""}})
+                continue
+            # The contents document goes first so the text stops counting as complete,
+            # and only if save_text has not just taken it back
+            if self.contents_collection.delete_one({"_id": content_hash, "unreferenced_at": {"$lt": threshold}}).deleted_count:
+                self.chunks_collection.delete_many({"content_hash": content_hash})
+                collected += 1
+        if collected:
+            logger.info(f"Deleted {collected} unreferenced document text(s)")
+        self._bump("texts_collected", collected)
+        return collected
+
+    def list_documents(self, chat_id=None, project_id=None, user_id=None):
+        """Return a chat's or project's documents without their text.
+
+        The documents have "text" set to None; call hydrate before reading it.
+        """
+        query = {"chat_id": chat_id} if chat_id else {"project_id": project_id}
+        if user_id:
+            query["user_id"] = user_id
+        references = self.references_collection.find(
+            query,
+            {"content_hash": 1, "name": 1, "type": 1, "size_mb": 1, "uploaded_at": 1}
+        ).sort("uploaded_at", ASCENDING)
+        return [
+            {
+                "name": ref["name"],
+                "text": None,
+                "type": ref["type"],
+                "uploaded_at": ref["uploaded_at"],
+                "size_mb": ref["size_mb"],
+                "content_hash": ref["content_hash"]
+            }
+            for ref in references
+        ]
+
+    def hydrate(self, documents):
+        """Load the text of any documents listed without it, in place.
+
+        Database errors are raised so the turn fails instead of silently
+        answering without the documents.
+        """
+        pending = [doc for doc in documents if doc.get("text") is None and doc.get("content_hash")]
+        if not pending:
+            return documents
+
+        texts = self.load_texts(doc["content_hash"] for doc in pending)
+        for doc in pending:
+            text = texts.get(doc["content_hash"])
+            if text is None:
+                logger.warning(f"Stored text for document {doc['name']} ({doc['content_hash'][:12]}) is missing")
+                self._bump("texts_missing")
+                text = MISSING_DOCUMENT_TEXT
+            else:
+                self._bump("texts_loaded")
+            doc["text"] = text
+        return documents
+
+    def _bump(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
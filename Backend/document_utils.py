@@ -1,5 +1,7 @@
 import os
 import json
+import io
+import shutil
 import tempfile
 import logging
 
@@ -7,19 +9,75 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def extract_text_from_document(file_obj, file_extension):
-    """Extract text from uploaded documents based on file type."""
+# Bump whenever extractor output changes so cached extractions are not reused
+EXTRACTOR_VERSION = "3"
+
+# Prefixes of the messages the extractors return instead of raising
+EXTRACTION_ERROR_PREFIXES = (
+    "Error extracting",
+    "Unsupported file type",
+    "PyPDF2 library is not installed",
+    "python-docx library is not installed"
+)
+
+# PDF engine: "pymupdf" (default) or "pypdf2"
+PDF_EXTRACTION_ENGINE = os.environ.get("PDF_EXTRACTION_ENGINE", "pymupdf").lower()
+# PDFs with at least this many pages are extracted in parallel page ranges (0 disables).
+# Off by default: each range reopens the whole PDF, which on few cores costs
+# more than it saves; measure with benchmarks/pdf_engines.py before enabling
+PDF_PARALLEL_PAGE_THRESHOLD = int(os.environ.get("PDF_PARALLEL_PAGE_THRESHOLD", 0))
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", 50))
+
+# Extracted text is capped at this many characters; parsing stops once it is reached (0 disables the cap)
+MAX_DOCUMENT_CHARS = int(os.environ.get("MAX_DOCUMENT_CHARS", 500000))
+
+# Formats parsed incrementally by iter_document_chunks
+STREAMABLE_EXTENSIONS = ['.csv', '.pdf', '.doc', '.docx']
+TEXT_CHUNK_CHARS = 64 * 1024
+
+# Non-seekable uploads are buffered in memory up to this size before spilling to disk
+EXTRACTION_SPOOL_THRESHOLD_MB = int(os.environ.get("EXTRACTION_SPOOL_THRESHOLD_MB", 20))
+
+class UnsupportedFileType(Exception):
+    """Raised by iter_document_chunks for extensions it cannot parse."""
+
+def is_extraction_error(text):
+    """Check whether an extractor returned an error message instead of document text."""
+    return text.startswith(EXTRACTION_ERROR_PREFIXES)
+
+def open_document_stream(file_obj):
+    """Return a seekable binary stream over an uploaded document without touching disk.
+
+    Seekable inputs (BytesIO, a Werkzeug FileStorage's stream) are used as they
+    are. Anything else is copied into memory, spilling to a temporary file only
+    above EXTRACTION_SPOOL_THRESHOLD_MB.
+    """
+    stream = getattr(file_obj, 'stream', file_obj)
+    if hasattr(stream, 'seekable') and stream.seekable():
+        stream.seek(0)
+        return stream
+
+    spooled = tempfile.SpooledTemporaryFile(max_size=EXTRACTION_SPOOL_THRESHOLD_MB * 1024 * 1024)
+    shutil.copyfileobj(stream, spooled)
+    spooled.seek(0)
+    return spooled
+
+def extract_text_from_document(file_obj, file_extension, max_chars=None):
+    """Extract text from uploaded documents based on file type.
+
+    With max_chars set, the document is parsed incrementally and parsing stops
+    once that many characters have been extracted.
+    """
+    if max_chars:
+        return extract_text_with_budget(file_obj, file_extension, max_chars)
+
     try:
         file_extension = file_extension.lower()
        
         # Basic text files - read directly
         if file_extension in ['.txt', '.md']:
-            content = file_obj.read()
             # Try to decode as UTF-8, fallback to latin-1 if needed
-            try:
-                return content.decode('utf-8')
-            except UnicodeDecodeError:
-                return content.decode('latin-1')
+            return decode_text(file_obj.read())
        
         # JSON files - parse and format
         elif file_extension == '.json':
@@ -29,113 +87,231 @@ def extract_text_from_document(file_obj, file_extension):
                 return json.dumps(json_content, indent=2)
             except:
                 # If JSON parsing fails, return raw content
-                try:
-                    return content.decode('utf-8')
-                except UnicodeDecodeError:
-                    return content.decode('latin-1')
-       
-        # CSV files - custom processing
-        elif file_extension == '.csv':
-            with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_file:
-                temp_file.write(file_obj.read())
-                temp_path = temp_file.name
-           
-            try:
-                return extract_text_from_csv(temp_path)
-            finally:
-                try:
-                    os.unlink(temp_path)
-                except:
-                    pass
-       
-        # Other file types - save temporarily and process
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_file:
-            temp_file.write(file_obj.read())
-            temp_path = temp_file.name
+                return decode_text(content)
        
+        # Binary and CSV files are parsed straight from memory, no temporary file needed
+        stream = open_document_stream(file_obj)
         try:
-            if file_extension == '.pdf':
-                return extract_text_from_pdf(temp_path)
+            if file_extension == '.csv':
+                return extract_text_from_csv(stream)
+            elif file_extension == '.pdf':
+                return extract_text_from_pdf(stream)
             elif file_extension in ['.doc', '.docx']:
-                return extract_text_from_word(temp_path)
+                return extract_text_from_word(stream)
             else:
                 return f"Unsupported file type: {file_extension}"
         finally:
-            # Clean up the temporary file
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
+            if stream is not file_obj:
+                stream.close()
    
     except Exception as e:
         logger.error(f"Error extracting text from document: {str(e)}")
         return f"Error extracting document text: {str(e)}"
  
-def extract_text_from_csv(file_path):
-    """Extract text from CSV files with better formatting."""
+def detect_text_encoding(stream, sample_bytes=64 * 1024):
+    """Guess whether a binary stream is UTF-8 or latin-1 from its first bytes, then rewind it."""
+    import codecs
+
+    sample = stream.read(sample_bytes)
+    stream.seek(0)
     try:
-        import csv
-       
-        text = ""
-        with open(file_path, 'r', newline='', encoding='utf-8') as file:
+        # Not final, so a multi-byte character cut off at the end of the sample is fine
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+def open_text_source(file_source):
+    """Open a path, or wrap a binary stream, as text for the CSV reader.
+
+    Files that are not UTF-8 (e.g. Excel CSV exports) are read as latin-1.
+    """
+    if isinstance(file_source, (str, os.PathLike)):
+        file_source = open(file_source, 'rb')
+    return io.TextIOWrapper(file_source, encoding=detect_text_encoding(file_source), errors='replace', newline='')
+
+def iter_csv_text(file):
+    """Yield the formatted text of a CSV file piece by piece."""
+    import csv
+
+    csv_reader = csv.reader(file)
+    headers = next(csv_reader, None)
+    if headers is None:
+        # Empty file
+        return
+   
+    # Add headers
+    yield "HEADERS: " + ", ".join(headers) + "\n\n"
+   
+    # Add rows with header labels (limit to first 100 rows for large files)
+    for i, row in enumerate(csv_reader, 1):
+        if i > 100:
+            yield f"\n... [truncated, showing first 100 of more rows] ...\n"
+            break
+           
+        yield f"ROW {i}:\n" + "".join(f"  {header}: {value}\n" for header, value in zip(headers, row)) + "\n"
+
+def extract_text_from_csv(file_source):
+    """Extract text from CSV files with better formatting.
+
+    file_source may be a path or a binary stream.
+    """
+    try:
+        file = open_text_source(file_source)
+        try:
             try:
-                csv_reader = csv.reader(file)
-                headers = next(csv_reader)
-               
-                # Add headers
-                text += "HEADERS: " + ", ".join(headers) + "\n\n"
-               
-                # Add rows with header labels (limit to first 100 rows for large files)
-                for i, row in enumerate(csv_reader, 1):
-                    if i > 100:
-                        text += f"\n... [truncated, showing first 100 of more rows] ...\n"
-                        break
-                       
-                    text += f"ROW {i}:\n"
-                    for j, (header, value) in enumerate(zip(headers, row)):
-                        text += f"  {header}: {value}\n"
-                    text += "\n"
-               
-                return text
+                return "".join(iter_csv_text(file))
             except Exception as e:
                 # Fallback to simple reading if CSV parsing fails
                 file.seek(0)
                 return file.read()
+        finally:
+            # Leave a caller's stream open, only close files we opened ourselves
+            if isinstance(file, io.TextIOWrapper) and not isinstance(file_source, (str, os.PathLike)):
+                file.detach()
+            else:
+                file.close()
     except Exception as e:
         logger.error(f"Error extracting text from CSV: {str(e)}")
         return f"Error extracting CSV text: {str(e)}"
  
-def extract_text_from_pdf(file_path):
-    """Extract text from a PDF file."""
+def extract_text_from_pdf(file_source, engine=None):
+    """Extract text from a PDF file.
+
+    file_source may be a path, raw bytes or a binary stream. The engine defaults
+    to PDF_EXTRACTION_ENGINE; PyPDF2 is used whenever PyMuPDF is unavailable or
+    fails on a file.
+    """
+    engine = (engine or PDF_EXTRACTION_ENGINE).lower()
+
+    if engine == "pymupdf":
+        try:
+            import fitz
+        except ImportError:
+            logger.warning("PyMuPDF is not installed, falling back to PyPDF2")
+        else:
+            try:
+                return extract_text_from_pdf_pymupdf(file_source)
+            except Exception as e:
+                logger.warning(f"PyMuPDF failed to extract PDF, falling back to PyPDF2: {str(e)}")
+                if hasattr(file_source, 'seek'):
+                    file_source.seek(0)
+
+    return extract_text_from_pdf_pypdf2(file_source)
+
+def format_pdf_text(num_pages, page_blocks):
+    """Assemble the PDF text output from per-page (or per-range) blocks."""
+    # Add document metadata
+    return f"PDF DOCUMENT: {num_pages} pages\n\n" + "".join(page_blocks)
+
+def format_pdf_page(page_num, page_text):
+    return f"--- PAGE {page_num + 1} ---\n" + page_text + "\n\n"
+
+def open_pymupdf_document(file_source):
+    """Open a path, raw bytes or a binary stream with PyMuPDF."""
+    import fitz
+
+    if isinstance(file_source, (str, os.PathLike)):
+        return fitz.open(file_source)
+    if isinstance(file_source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=file_source, filetype="pdf")
+    file_source.seek(0)
+    return fitz.open(stream=file_source.read(), filetype="pdf")
+
+def count_pdf_pages(file_source):
+    with open_pymupdf_document(file_source) as doc:
+        return doc.page_count
+
+def extract_pdf_page_range(file_source, start, end):
+    """Extract pages [start, end) with PyMuPDF as formatted page blocks.
+
+    Used as a worker process task for page-range-parallel extraction, so
+    file_source should be a path or raw bytes.
+    """
+    with open_pymupdf_document(file_source) as doc:
+        return "".join(
+            format_pdf_page(page_num, doc[page_num].get_text())
+            for page_num in range(start, min(end, doc.page_count))
+        )
+
+def iter_pdf_text_pymupdf(file_source):
+    """Yield the PDF header and then one formatted block per page, using PyMuPDF."""
+    with open_pymupdf_document(file_source) as doc:
+        yield format_pdf_text(doc.page_count, [])
+        for page_num in range(doc.page_count):
+            yield format_pdf_page(page_num, doc[page_num].get_text())
+
+def extract_text_from_pdf_pymupdf(file_source):
+    """Extract text from a PDF with PyMuPDF."""
+    return "".join(iter_pdf_text_pymupdf(file_source))
+
+def pdf_page_ranges(num_pages, pages_per_task=None):
+    """Split a PDF into the (start, end) page ranges extracted by each parallel task."""
+    pages_per_task = pages_per_task or PDF_PAGES_PER_TASK
+    return [(start, min(start + pages_per_task, num_pages)) for start in range(0, num_pages, pages_per_task)]
+
+def iter_pdf_text_pypdf2(file_source):
+    """Yield the PDF header and then one formatted block per page, using PyPDF2."""
+    import PyPDF2
+
+    if isinstance(file_source, (bytes, bytearray, memoryview)):
+        file_source = io.BytesIO(file_source)
+
+    # PdfReader opens paths itself and reads streams in place
+    reader = PyPDF2.PdfReader(file_source)
+    yield format_pdf_text(len(reader.pages), [])
+    for page_num, page in enumerate(reader.pages):
+        yield format_pdf_page(page_num, page.extract_text())
+
+def extract_text_from_pdf_pypdf2(file_source):
+    """Extract text from a PDF with PyPDF2."""
     try:
         try:
             import PyPDF2
         except ImportError:
             return "PyPDF2 library is not installed. Install with: pip install PyPDF2"
        
-        text = ""
-        with open(file_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            num_pages = len(reader.pages)
-           
-            # Add document metadata
-            text += f"PDF DOCUMENT: {num_pages} pages\n\n"
-       
-            for page_num in range(num_pages):
-                page = reader.pages[page_num]
-                page_text = page.extract_text()
-               
-                text += f"--- PAGE {page_num + 1} ---\n"
-                text += page_text + "\n\n"
-       
-        return text
+        return "".join(iter_pdf_text_pypdf2(file_source))
    
     except Exception as e:
         logger.error(f"Error extracting text from PDF: {str(e)}")
         return f"Error extracting PDF text: {str(e)}"
  
-def extract_text_from_word(file_path):
-    """Extract text from a Word document."""
+def iter_word_text(doc):
+    """Yield the formatted text of a python-docx Document piece by piece."""
+    # Extract metadata
+    yield "WORD DOCUMENT\n\n"
+   
+    # Extract text from paragraphs with section headers
+    current_section = "Main Document"
+    yield f"SECTION: {current_section}\n"
+   
+    for para in doc.paragraphs:
+        # Paragraph.text is rebuilt from the XML on every access
+        para_text = para.text
+
+        # Check if this might be a heading
+        if para.style.name.startswith('Heading'):
+            current_section = para_text
+            yield f"\nSECTION: {current_section}\n"
+       
+        if para_text.strip():  # Only include non-empty paragraphs
+            yield para_text + "\n"
+   
+    # Extract text from tables
+    if doc.tables:
+        yield "\nTABLES:\n"
+        for i, table in enumerate(doc.tables):
+            yield f"\nTable {i+1}:\n"
+            for row in table.rows:
+                yield " | ".join(cell.text for cell in row.cells) + "\n"
+            yield "\n"
+
+def extract_text_from_word(file_source):
+    """Extract text from a Word document.
+
+    file_source may be a path or a binary stream.
+    """
     try:
         # Try to import docx
         try:
@@ -144,36 +320,112 @@ def extract_text_from_word(file_path):
             return "python-docx library is not installed. Install with: pip install python-docx"
        
         # Load the document
-        doc = docx.Document(file_path)
-       
-        # Extract metadata
-        text = "WORD DOCUMENT\n\n"
-       
-        # Extract text from paragraphs with section headers
-        current_section = "Main Document"
-        text += f"SECTION: {current_section}\n"
-       
-        for para in doc.paragraphs:
-            # Check if this might be a heading
-            if para.style.name.startswith('Heading'):
-                current_section = para.text
-                text += f"\nSECTION: {current_section}\n"
-           
-            if para.text.strip():  # Only include non-empty paragraphs
-                text += para.text + "\n"
-       
-        # Extract text from tables
-        if doc.tables:
-            text += "\nTABLES:\n"
-            for i, table in enumerate(doc.tables):
-                text += f"\nTable {i+1}:\n"
-                for row in table.rows:
-                    row_text = " | ".join(cell.text for cell in row.cells)
-                    text += row_text + "\n"
-                text += "\n"
+        doc = docx.Document(file_source)
        
-        return text
+        return "".join(iter_word_text(doc))
    
     except Exception as e:
         logger.error(f"Error extracting text from Word document: {str(e)}")
-        return f"Error extracting Word document text: {str(e)}"
\ No newline at end of file
+        return f"Error extracting Word document text: {str(e)}"
+
+def decode_text(content):
+    """Decode uploaded text as UTF-8, falling back to latin-1."""
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return content.decode('latin-1')
+
+def iter_pdf_text(file_source, engine=None):
+    """Yield PDF text page by page with the configured engine (see extract_text_from_pdf)."""
+    engine = (engine or PDF_EXTRACTION_ENGINE).lower()
+
+    if engine == "pymupdf":
+        try:
+            pages = iter_pdf_text_pymupdf(file_source)
+            # Open the document now so an unreadable file can still fall back to PyPDF2
+            header = next(pages)
+        except Exception as e:
+            logger.warning(f"PyMuPDF could not open PDF, falling back to PyPDF2: {str(e)}")
+            if hasattr(file_source, 'seek'):
+                file_source.seek(0)
+        else:
+            yield header
+            yield from pages
+            return
+
+    yield from iter_pdf_text_pypdf2(file_source)
+
+def iter_document_chunks(file_obj, file_extension):
+    """Yield the text of an uploaded document as it is parsed.
+
+    PDFs are yielded per page, Word documents per paragraph and table row, and
+    CSV files per row. Parsing stops as soon as the caller stops iterating.
+    The chunks join to the same text extract_text_from_document returns.
+    Unlike extract_text_from_document, errors are raised, not returned.
+    """
+    file_extension = file_extension.lower()
+
+    if file_extension in ['.txt', '.md']:
+        text = decode_text(file_obj.read())
+        for start in range(0, len(text), TEXT_CHUNK_CHARS):
+            yield text[start:start + TEXT_CHUNK_CHARS]
+        return
+
+    if file_extension == '.json':
+        yield extract_text_from_document(file_obj, file_extension)
+        return
+
+    if file_extension not in STREAMABLE_EXTENSIONS:
+        raise UnsupportedFileType(f"Unsupported file type: {file_extension}")
+
+    stream = open_document_stream(file_obj)
+    try:
+        if file_extension == '.csv':
+            file = open_text_source(stream)
+            try:
+                yield from iter_csv_text(file)
+            finally:
+                file.detach()
+        elif file_extension == '.pdf':
+            yield from iter_pdf_text(stream)
+        else:
+            import docx
+            yield from iter_word_text(docx.Document(stream))
+    finally:
+        if stream is not file_obj:
+            stream.close()
+
+def take_within_budget(chunks, budget, length_function=len):
+    """Yield chunks until their combined length reaches the budget.
+
+    The chunk that crosses the budget is cut short and followed by a truncation
+    marker, and the source iterator is closed so it stops parsing. The
+    length_function can count characters (the default) or tokens.
+    """
+    used = 0
+    try:
+        for chunk in chunks:
+            size = length_function(chunk)
+            if used + size > budget:
+                remaining = budget - used
+                if remaining > 0:
+                    # Cut proportionally so this also works for token counts
+                    yield chunk[:int(len(chunk) * remaining / size)]
+                yield "\n... [truncated, the rest of the document was not read] ...\n"
+                return
+            used += size
+            yield chunk
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+
+def extract_text_with_budget(file_obj, file_extension, budget, length_function=len):
+    """Extract document text, parsing only as much of the file as fits in the budget."""
+    try:
+        return "".join(take_within_budget(iter_document_chunks(file_obj, file_extension), budget, length_function))
+    except UnsupportedFileType as e:
+        return str(e)
+    except Exception as e:
+        logger.error(f"Error extracting text from document: {str(e)}")
+        return f"Error extracting document text: {str(e)}"
@@ -0,0 +1,159 @@
+import os
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime
+
+from document_utils import EXTRACTOR_VERSION, MAX_DOCUMENT_CHARS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Extraction cache configuration
+EXTRACTION_CACHE_MEMORY_MB = int(os.environ.get("EXTRACTION_CACHE_MEMORY_MB", 64))
+EXTRACTION_CACHE_BACKEND = os.environ.get("EXTRACTION_CACHE_BACKEND", "none").lower()  # none, disk or mongo
+EXTRACTION_CACHE_DIR = os.environ.get("EXTRACTION_CACHE_DIR", "/tmp/growwgpt-extraction-cache")
+
+# Cosmos DB caps documents at 2MB, leave room for the other fields
+MAX_MONGO_CACHE_TEXT_BYTES = 1536 * 1024
+
+def content_cache_key(data, file_extension):
+    """Build the cache key for a document: SHA-256 of its bytes plus extension, extractor version and size cap."""
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{digest}:{file_extension.lower()}:v{EXTRACTOR_VERSION}:{MAX_DOCUMENT_CHARS}"
+
+class DiskCacheTier:
+    """Persistent cache tier storing extracted text as files on local disk."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        # Keys contain ':' which is not portable in file names
+        return os.path.join(self.directory, key.replace(":", "_") + ".txt")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, text):
+        # Write to a temporary name first so readers never see a partial file
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(temp_path, path)
+
+class MongoCacheTier:
+    """Persistent cache tier storing extracted text in a Mongo collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get(self, key):
+        cached = self.collection.find_one({"_id": key}, {"text": 1})
+        return cached["text"] if cached else None
+
+    def put(self, key, text):
+        if len(text.encode("utf-8")) > MAX_MONGO_CACHE_TEXT_BYTES:
+            return
+        self.collection.replace_one(
+            {"_id": key},
+            {"_id": key, "text": text, "created_at": datetime.now()},
+            upsert=True
+        )
+
+class ExtractionCache:
+    """Content-addressed cache for extracted document text.
+
+    Lookups go to an in-memory LRU first, then to the optional persistent tier.
+    Persistent hits are promoted into memory. DocumentIngestor only puts
+    successful extractions, errors are never cached.
+    """
+
+    def __init__(self, max_bytes, persistent_tier=None):
+        self.max_bytes = max_bytes
+        self.persistent_tier = persistent_tier
+        self._entries = OrderedDict()  # key -> text
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "misses": 0,
+            "errors": 0
+        }
+
+    def get(self, key):
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return text
+
+        if self.persistent_tier:
+            try:
+                text = self.persistent_tier.get(key)
+            except Exception as e:
+                logger.warning(f"Error reading extraction cache: {str(e)}")
+                self._bump("errors")
+                text = None
+            if text is not None:
+                self._bump("persistent_hits")
+                self._put_memory(key, text)
+                return text
+
+        self._bump("misses")
+        return None
+
+    def put(self, key, text):
+        self._put_memory(key, text)
+        if self.persistent_tier:
+            try:
+                self.persistent_tier.put(key, text)
+            except Exception as e:
+                logger.warning(f"Error writing extraction cache: {str(e)}")
+                self._bump("errors")
+
+    def _put_memory(self, key, text):
+        size = len(text)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= len(self._entries.pop(key))
+            self._entries[key] = text
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+
+    def _bump(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._total_bytes
+        lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["persistent_hits"]) / lookups, 3) if lookups else 0.0
+        stats["backend"] = EXTRACTION_CACHE_BACKEND
+        return stats
+
+def create_extraction_cache(mongo_collection=None):
+    """Create the extraction cache with the persistent tier selected by EXTRACTION_CACHE_BACKEND."""
+    persistent_tier = None
+    if EXTRACTION_CACHE_BACKEND == "disk":
+        persistent_tier = DiskCacheTier(EXTRACTION_CACHE_DIR)
+    elif EXTRACTION_CACHE_BACKEND == "mongo" and mongo_collection is not None:
+        persistent_tier = MongoCacheTier(mongo_collection)
+
+    return ExtractionCache(EXTRACTION_CACHE_MEMORY_MB * 1024 * 1024, persistent_tier)
@@ -0,0 +1,146 @@
+import os
+import re
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Grounding cache configuration
+GROUNDING_CACHE_TTL_SECONDS = int(os.environ.get("GROUNDING_CACHE_TTL_SECONDS", 300))  # 0 disables the cache
+GROUNDING_CACHE_MAX_ENTRIES = int(os.environ.get("GROUNDING_CACHE_MAX_ENTRIES", 500))
+GROUNDING_CACHE_WAIT_SECONDS = int(os.environ.get("GROUNDING_CACHE_WAIT_SECONDS", 120))
+
+def normalize_query(query):
+    """Normalize a query for cache lookups: case, whitespace and trailing punctuation are ignored."""
+    query = re.sub(r"\s+", " ", query or "").strip().lower()
+    return query.rstrip("?!. ")
+
+def grounding_cache_key(query, model, context):
+    """Build the cache key for a grounding answer from the normalized query, the model and the context sent with it."""
+    context_hash = hashlib.sha256((context or "").encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{model}\n{normalize_query(query)}\n{context_hash}".encode("utf-8")).hexdigest()
+
+class GroundingCache:
+    """Short-lived LRU cache of grounded answers with single-flight lookups.
+
+    Entries expire ttl_seconds after they were stored and the least recently
+    used entry is evicted once max_entries is reached. Concurrent misses for
+    the same key share one computation: the first caller runs it and the
+    others wait for its result instead of starting their own agent run.
+    """
+
+    def __init__(self, ttl_seconds=GROUNDING_CACHE_TTL_SECONDS, max_entries=GROUNDING_CACHE_MAX_ENTRIES,
+                 wait_seconds=GROUNDING_CACHE_WAIT_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.wait_seconds = wait_seconds
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._inflight = {}  # key -> Future of the running computation
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "evictions": 0,
+            "expirations": 0
+        }
+
+    @property
+    def enabled(self):
+        return self.ttl_seconds > 0 and self.max_entries > 0
+
+    def get(self, key):
+        """Return the cached value for key, or None if it is missing or expired."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            value = self._lookup(key)
+            self._stats["hits" if value is not None else "misses"] += 1
+            return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def get_or_compute(self, key, compute, cacheable=None):
+        """Return (value, source) where source is "hit", "coalesced" or "miss".
+
+        On a miss compute() is called once, however many callers ask for the
+        key at the same time, and its value is stored if cacheable(value) is
+        true (always, if cacheable is None). Waiters that time out compute
+        the value themselves.
+        """
+        if not self.enabled:
+            return compute(), "miss"
+
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self._stats["hits"] += 1
+                return value, "hit"
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                self._stats["misses"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            try:
+                return future.result(self.wait_seconds), "coalesced"
+            except TimeoutError:
+                logger.warning("Timed out waiting for an identical grounding request, running it again")
+                return compute(), "miss"
+
+        try:
+            value = compute()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            if cacheable is None or cacheable(value):
+                self.put(key, value)
+            future.set_result(value)
+            return value, "miss"
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _lookup(self, key):
+        # Caller holds the lock
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self._stats["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["inflight"] = len(self._inflight)
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_rate"] = round((stats["hits"] + stats["coalesced"]) / lookups, 4) if lookups else 0.0
+        return stats
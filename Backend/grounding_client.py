@@ -0,0 +1,258 @@
+import os
+import time
+import hashlib
+import threading
+import logging
+from contextlib import contextmanager
+from azure.ai.projects import AIProjectClient
+from azure.identity import DefaultAzureCredential
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Grounding client configuration
+GROUNDING_CLIENT_TTL_SECONDS = int(os.environ.get("GROUNDING_CLIENT_TTL_SECONDS", 3600))
+# Messages of a conversation's grounding thread the agent sees on each run
+GROUNDING_THREAD_MAX_MESSAGES = int(os.environ.get("GROUNDING_THREAD_MAX_MESSAGES", 20))
+
+GROUNDING_AGENT_NAME_PREFIX = "growwgpt-grounding"
+
+GROUNDING_STAGES = ("client_init", "agent_create", "run", "message_fetch", "total")
+
+class StageTimer:
+    """Collects per-stage wall-clock timings of one request, in milliseconds."""
+
+    def __init__(self):
+        self.timings = {}
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[f"{name}_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    def mark(self, name):
+        """Record the time since the request started, the first time name is marked."""
+        self.timings.setdefault(f"{name}_ms", round((time.perf_counter() - self._started) * 1000, 2))
+
+    def finish(self):
+        self.timings["total_ms"] = round((time.perf_counter() - self._started) * 1000, 2)
+        return self.timings
+
+class GroundingClientPool:
+    """Shares one Azure AI Project client and the resolved Bing connection id per process.
+
+    The credential is created once and caches its access tokens; the project
+    client and connection id are resolved on first use and refreshed in the
+    background after ttl_seconds, or rebuilt straight away after invalidate().
+    Clients are never closed while requests may still hold them; a replaced
+    client is left to the garbage collector.
+    """
+
+    def __init__(self, ttl_seconds=GROUNDING_CLIENT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._credential = None
+        self._client = None
+        self._conn_id = None
+        self._config = None
+        self._expires_at = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()  # held while a client is built; taken before _lock, never inside it
+        self._agents = {}  # agent name -> agent id
+        self._agents_lock = threading.Lock()
+        self._active_threads = set()  # thread ids with a run in progress in this process
+        self._threads_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "client_builds": 0,
+            "invalidations": 0,
+            "agents_created": 0,
+            "agents_found": 0,
+            "agents_reused": 0,
+            "threads_created": 0,
+            "threads_reused": 0,
+            "threads_busy": 0
+        }
+        self._stage_totals = {stage: 0.0 for stage in GROUNDING_STAGES}
+
+    def get(self, project_conn_str, bing_conn_name):
+        """Return (project_client, bing_connection_id), building or refreshing them if needed.
+
+        Clients are built without holding the pool lock. An expired client is
+        refreshed in the background and keeps serving until its replacement
+        is ready; only a request with no usable client waits for a build.
+        """
+        config = (project_conn_str, bing_conn_name)
+        with self._lock:
+            if self._client is not None and self._config == config:
+                if time.monotonic() >= self._expires_at and not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh, args=(config,), name="grounding-refresh", daemon=True).start()
+                return self._client, self._conn_id
+
+        # One build at a time; requests arriving meanwhile use its result
+        with self._build_lock:
+            with self._lock:
+                if self._client is not None and self._config == config:
+                    return self._client, self._conn_id
+            client, conn_id = self._build(config)
+            with self._lock:
+                self._install(config, client, conn_id)
+            return client, conn_id
+
+    def _refresh(self, config):
+        try:
+            with self._build_lock:
+                client, conn_id = self._build(config)
+                with self._lock:
+                    self._install(config, client, conn_id)
+        except Exception as e:
+            logger.warning(f"Could not refresh grounding client, keeping the current one: {str(e)}")
+            with self._lock:
+                # Try again later rather than on every request
+                self._expires_at = time.monotonic() + min(60, self.ttl_seconds)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _build(self, config):
+        project_conn_str, bing_conn_name = config
+        if self._credential is None:
+            self._credential = DefaultAzureCredential()
+
+        client = AIProjectClient.from_connection_string(
+            credential=self._credential,
+            conn_str=project_conn_str,
+        )
+        conn_id = client.connections.get(connection_name=bing_conn_name).id
+        with self._stats_lock:
+            self._stats["client_builds"] += 1
+        logger.info(f"Built Azure AI Project client, Bing connection ID: {conn_id}")
+        return client, conn_id
+
+    def _install(self, config, client, conn_id):
+        if config != self._config:
+            # Agents belong to a project; a different project needs its own
+            with self._agents_lock:
+                self._agents.clear()
+        self._client, self._conn_id, self._config = client, conn_id, config
+        self._expires_at = time.monotonic() + self.ttl_seconds
+
+    def get_agent(self, project_client, model, instructions, tools):
+        """Return the id of a long-lived agent for this model and instructions.
+
+        Agents are named after a hash of their configuration, so replicas and
+        restarts find and reuse the same agent instead of creating one per
+        query. Conversation context goes into thread messages, never into the
+        instructions, which keeps the number of distinct agents small.
+        """
+        config_hash = hashlib.sha256(f"{model}\n{instructions}".encode("utf-8")).hexdigest()[:16]
+        name = f"{GROUNDING_AGENT_NAME_PREFIX}-{model}-{config_hash}"
+        with self._agents_lock:
+            agent_id = self._agents.get(name)
+            if agent_id:
+                self._bump("agents_reused")
+                return agent_id
+
+            agent_id = self._find_agent(project_client, name)
+            if agent_id:
+                self._bump("agents_found")
+            else:
+                agent = project_client.agents.create_agent(
+                    model=model,
+                    name=name,
+                    instructions=instructions,
+                    tools=tools,
+                    headers={"x-ms-enable-preview": "true"},
+                )
+                agent_id = agent.id
+                self._bump("agents_created")
+                logger.info(f"Created grounding agent {name} with ID: {agent_id}")
+            self._agents[name] = agent_id
+            return agent_id
+
+    def _find_agent(self, project_client, name):
+        after = None
+        while True:
+            page = project_client.agents.list_agents(limit=100, after=after)
+            for agent in page.data:
+                if agent.name == name:
+                    return agent.id
+            if not page.has_more:
+                return None
+            after = page.last_id
+
+    def forget_agent(self, agent_id):
+        """Stop using an agent, e.g. after it was deleted from the project."""
+        with self._agents_lock:
+            for name, cached_id in list(self._agents.items()):
+                if cached_id == agent_id:
+                    del self._agents[name]
+
+    def claim_thread(self, thread_id):
+        """Mark a thread as having a run in progress; False if another request already has one.
+
+        The service rejects new messages and runs on a thread while a run is
+        active, so a second concurrent request of the same conversation must
+        use a thread of its own.
+        """
+        with self._threads_lock:
+            if thread_id in self._active_threads:
+                self._bump("threads_busy")
+                return False
+            self._active_threads.add(thread_id)
+            return True
+
+    def release_thread(self, thread_id):
+        with self._threads_lock:
+            self._active_threads.discard(thread_id)
+
+    def record_thread(self, reused):
+        self._bump("threads_reused" if reused else "threads_created")
+
+    def _bump(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def invalidate(self):
+        """Drop the cached client so the next request rebuilds it, e.g. after an auth error."""
+        with self._lock:
+            self._client = None
+            self._conn_id = None
+        with self._stats_lock:
+            self._stats["invalidations"] += 1
+
+    def warm(self, project_conn_str, bing_conn_name):
+        """Build the client and resolve the connection in the background, ahead of the first request."""
+        if not project_conn_str or not bing_conn_name:
+            return
+
+        def build():
+            try:
+                self.get(project_conn_str, bing_conn_name)
+            except Exception as e:
+                logger.warning(f"Could not warm grounding client: {str(e)}")
+
+        threading.Thread(target=build, name="grounding-warmup", daemon=True).start()
+
+    def record(self, timings):
+        """Add one request's stage timings to the running totals."""
+        with self._stats_lock:
+            self._stats["requests"] += 1
+            for stage in GROUNDING_STAGES:
+                self._stage_totals[stage] += timings.get(f"{stage}_ms", 0)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            requests = stats["requests"] or 1
+            stats["avg_stage_ms"] = {stage: round(total / requests, 2) for stage, total in self._stage_totals.items()}
+        stats["client_cached"] = self._client is not None
+        stats["agents_cached"] = len(self._agents)
+        stats["threads_active"] = len(self._active_threads)
+        return stats
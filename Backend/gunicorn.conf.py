@@ -0,0 +1,46 @@
+import os
+import sys
+
+# The backend setting is parsed and validated in one place, shared with the app
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from conversation_store import CONVERSATION_STORE_BACKEND
+
+# Requests spend nearly all their time waiting on Azure OpenAI, Cosmos DB and
+# Bing agent runs, so each worker serves many of them at once on threads.
+# Document parsing is CPU-bound but already runs in ingestion worker processes.
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")  # gthread or eventlet
+# The in-memory conversation store is per process, so with several workers
+# successive turns of a conversation would see diverging copies of its context;
+# only run more than one worker with the shared Redis store
+workers = int(os.environ.get("GUNICORN_WORKERS", 2 if CONVERSATION_STORE_BACKEND == "redis" else 1))
+# Each thread carries one in-flight request while it waits on the upstream call
+threads = int(os.environ.get("GUNICORN_THREADS", 32))
+# Only used by the eventlet worker class
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 500))
+
+# Long completions and streamed responses keep a request open for minutes
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 300))
+# On SIGTERM workers stop accepting and get this long to finish in-flight completions
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 120))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+# Each worker imports the app itself; background threads and clients do not survive a fork
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
+
+def on_starting(server):
+    if server.cfg.workers > 1 and CONVERSATION_STORE_BACKEND != "redis":
+        server.log.warning(
+            f"Running {server.cfg.workers} workers with the {CONVERSATION_STORE_BACKEND} conversation store; "
+            "each worker keeps its own conversation contexts. Set CONVERSATION_STORE_BACKEND=redis."
+        )
+
+def worker_exit(server, worker):
+    """Flush queued chat writes and stop background services once the worker has drained."""
+    app_module = sys.modules.get("app")
+    if app_module is not None:
+        app_module.shutdown_app()
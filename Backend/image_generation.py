@@ -3,6 +3,8 @@ from openai import AzureOpenAI
 import logging
 import json
 
+from clients import LazyClient
+
 DALLE_ENDPOINT = os.environ.get("AZURE_DALLE_ENDPOINT")
 DALLE_API_KEY = os.environ.get("AZURE_DALLE_API_KEY")
 DALLE_API_VERSION = os.environ.get("DALLE_API_VERSION")
@@ -11,13 +13,18 @@ DALLE_DEPLOYMENT = os.environ.get("DALLE_DEPLOYMENT")
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_dalle_client():
-    client = AzureOpenAI(
+# Built on the first image request and shared afterwards
+dalle_client = LazyClient(
+    lambda: AzureOpenAI(
         api_version=DALLE_API_VERSION,
         azure_endpoint=DALLE_ENDPOINT,
         api_key=DALLE_API_KEY
-    )
-    return client
+    ),
+    "DALL-E"
+)
+
+def get_dalle_client():
+    return dalle_client.get()
  
 def generate_image(prompt):
     try:
@@ -0,0 +1,244 @@
+import os
+import time
+import threading
+import logging
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Index management configuration
+# explain() is billed like the query it describes and every replica would run
+# it on startup, so plan checks are opt-in; tests/test_indexes.py covers the checker
+INDEX_VERIFY_QUERY_PLANS = os.environ.get("INDEX_VERIFY_QUERY_PLANS", "false").lower() == "true"
+EXTRACTION_CACHE_TTL_DAYS = int(os.environ.get("EXTRACTION_CACHE_TTL_DAYS", 30))
+
+# Every index the application relies on, declared next to the query shapes it
+# serves. Each shape is a (filter, sort) pair with placeholder values that
+# verify_query_plans runs through explain(). Specs with expire_after_seconds
+# are TTL indexes on a date field; their collections are otherwise never cleaned up.
+INDEX_SPECS = [
+    {
+        "collection": "chats",
+        "keys": [("user_id", ASCENDING), ("is_deleted", ASCENDING), ("updated_at", DESCENDING), ("_id", DESCENDING)],
+        "used_by": "get_chats (sidebar page and total), keyset pagination",
+        "queries": [
+            ({"user_id": "", "is_deleted": False}, [("updated_at", DESCENDING), ("_id", DESCENDING)]),
+            ({"user_id": "", "is_deleted": False, "$or": [
+                {"updated_at": {"$lt": datetime(2000, 1, 1)}},
+                {"updated_at": datetime(2000, 1, 1), "_id": {"$lt": ""}}
+            ]}, [("updated_at", DESCENDING), ("_id", DESCENDING)])
+        ]
+    },
+    {
+        "collection": "chats",
+        "keys": [("is_deleted", ASCENDING), ("updated_at", DESCENDING)],
+        "used_by": "MaintenanceScheduler.archive_old_chats",
+        "queries": [
+            ({"is_deleted": False, "is_archived": {"$ne": True}, "updated_at": {"$lt": datetime(2000, 1, 1)}}, None)
+        ]
+    },
+    {
+        # Single-chat queries that also filter on user_id (get_chat_messages,
+        # delete_chat) apply it as a residual filter within one chat's messages;
+        # putting user_id between chat_id and order would stop the
+        # chat_id-only queries from using the index for their sort.
+        "collection": "conversations",
+        "keys": [("chat_id", ASCENDING), ("order", ASCENDING)],
+        "used_by": "ChatRepository.load_turns, get_chat_messages, delete_chat, share_chat",
+        "queries": [
+            ({"chat_id": ""}, [("order", DESCENDING)]),
+            ({"chat_id": "", "user_id": ""}, [("order", ASCENDING)])
+        ]
+    },
+    {
+        "collection": "projects",
+        "keys": [("user_id", ASCENDING), ("created_at", DESCENDING)],
+        "used_by": "project listing",
+        "queries": [
+            ({"user_id": ""}, [("created_at", DESCENDING)])
+        ]
+    },
+    {
+        "collection": "project_documents",
+        "keys": [("project_id", ASCENDING), ("uploaded_at", ASCENDING)],
+        "used_by": "DocumentStore.list_documents (projects)",
+        "queries": [
+            ({"project_id": ""}, [("uploaded_at", ASCENDING)])
+        ]
+    },
+    {
+        "collection": "project_documents",
+        "keys": [("chat_id", ASCENDING), ("uploaded_at", ASCENDING)],
+        "used_by": "DocumentStore.list_documents (chats)",
+        "queries": [
+            ({"chat_id": "", "user_id": ""}, [("uploaded_at", ASCENDING)])
+        ]
+    },
+    {
+        "collection": "project_documents",
+        "keys": [("content_hash", ASCENDING)],
+        "used_by": "DocumentStore.remove_references, DocumentStore.collect_garbage",
+        "queries": [
+            ({"content_hash": {"$in": [""]}}, None),
+            ({"content_hash": ""}, None)
+        ]
+    },
+    {
+        "collection": "document_contents",
+        "keys": [("unreferenced_at", ASCENDING)],
+        "used_by": "DocumentStore.collect_garbage",
+        "queries": [
+            ({"unreferenced_at": {"$lt": datetime(2000, 1, 1)}}, None)
+        ]
+    },
+    {
+        "collection": "document_chunks",
+        "keys": [("content_hash", ASCENDING), ("seq", ASCENDING)],
+        "used_by": "DocumentStore.load_texts",
+        "queries": [
+            ({"content_hash": {"$in": [""]}}, [("content_hash", ASCENDING), ("seq", ASCENDING)])
+        ]
+    },
+    {
+        # Cached extractions are only an optimisation, so old ones are simply dropped
+        "collection": "extraction_cache",
+        "keys": [("created_at", ASCENDING)],
+        "expire_after_seconds": EXTRACTION_CACHE_TTL_DAYS * 86400,
+        "used_by": "MongoCacheTier (expiry)",
+        "queries": []
+    },
+    {
+        # Leases expire at expires_at; LeaderLock.acquire recreates a deleted one
+        "collection": "locks",
+        "keys": [("expires_at", ASCENDING)],
+        "expire_after_seconds": 0,
+        "used_by": "LeaderLock (expiry)",
+        "queries": []
+    },
+    {
+        "collection": "shared_chats",
+        "keys": [("share_id", ASCENDING)],
+        "used_by": "get_shared_chat",
+        "queries": [
+            ({"share_id": "", "is_active": True}, None)
+        ]
+    },
+    {
+        "collection": "shared_chats",
+        "keys": [("original_chat_id", ASCENDING)],
+        "used_by": "share_chat",
+        "queries": [
+            ({"original_chat_id": ""}, None)
+        ]
+    },
+    {
+        "collection": "shared_conversations",
+        "keys": [("share_id", ASCENDING), ("order", ASCENDING)],
+        "used_by": "get_shared_chat",
+        "queries": [
+            ({"share_id": ""}, [("order", ASCENDING)])
+        ]
+    }
+]
+
+def find_plan_stages(plan):
+    """Collect every stage name in an explain() plan tree."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(find_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(find_plan_stages(value))
+    return stages
+
+def uses_collection_scan(explain_output):
+    """Return True if the winning plan of an explain() result scans the whole collection."""
+    query_planner = explain_output.get("queryPlanner", explain_output)
+    return "COLLSCAN" in find_plan_stages(query_planner.get("winningPlan", query_planner))
+
+class IndexManager:
+    """Creates the declared indexes in the background and checks that queries use them.
+
+    create_index is a no-op for indexes that already exist, so every replica
+    can run this on startup without coordination and without delaying the
+    first request.
+    """
+
+    def __init__(self, db, specs=INDEX_SPECS, verify_query_plans=INDEX_VERIFY_QUERY_PLANS):
+        self.db = db
+        self.specs = specs
+        self.verify = verify_query_plans
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "indexes_ensured": 0,
+            "errors": 0,
+            "collection_scans": [],
+            "completed_at": None,
+            "duration_ms": None
+        }
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run, name="index-manager", daemon=True)
+        self._thread.start()
+
+    def run(self):
+        started = time.perf_counter()
+        self.ensure_indexes()
+        if self.verify:
+            self.verify_query_plans()
+        with self._stats_lock:
+            self._stats["completed_at"] = datetime.now().isoformat()
+            self._stats["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    def ensure_indexes(self):
+        for spec in self.specs:
+            try:
+                if "expire_after_seconds" in spec:
+                    self.db[spec["collection"]].create_index(spec["keys"], expireAfterSeconds=spec["expire_after_seconds"])
+                else:
+                    self.db[spec["collection"]].create_index(spec["keys"])
+                self._bump("indexes_ensured")
+            except Exception as e:
+                logger.error(f"Error creating index {spec['keys']} on {spec['collection']}: {str(e)}")
+                self._bump("errors")
+
+    def verify_query_plans(self):
+        """Explain every declared query shape and log the ones that scan their collection.
+
+        Returns a list of (collection, used_by, filter) for each collection scan.
+        """
+        scans = []
+        for spec in self.specs:
+            for query_filter, sort in spec["queries"]:
+                try:
+                    cursor = self.db[spec["collection"]].find(query_filter)
+                    if sort:
+                        cursor = cursor.sort(sort)
+                    if uses_collection_scan(cursor.explain()):
+                        logger.warning(f"Query on {spec['collection']} for {spec['used_by']} scans the whole collection: {query_filter}")
+                        scans.append((spec["collection"], spec["used_by"], str(query_filter)))
+                except Exception as e:
+                    logger.warning(f"Could not explain query on {spec['collection']}: {str(e)}")
+        with self._stats_lock:
+            self._stats["collection_scans"] = [f"{collection}: {used_by}" for collection, used_by, _ in scans]
+        if not scans:
+            logger.info("All declared query shapes are served by an index")
+        return scans
+
+    def _bump(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["indexes_declared"] = len(self.specs)
+        return stats
@@ -0,0 +1,234 @@
+import os
+import io
+import time
+import itertools
+import threading
+import logging
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+from document_utils import (
+    MAX_DOCUMENT_CHARS, PDF_EXTRACTION_ENGINE, PDF_PARALLEL_PAGE_THRESHOLD,
+    count_pdf_pages, extract_pdf_page_range, extract_text_from_document,
+    format_pdf_text, is_extraction_error, pdf_page_ranges, take_within_budget
+)
+from extraction_cache import content_cache_key
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Ingestion configuration
+INGESTION_MAX_WORKERS = int(os.environ.get("INGESTION_MAX_WORKERS", min(4, os.cpu_count() or 1)))
+INGESTION_FILE_TIMEOUT_SECONDS = int(os.environ.get("INGESTION_FILE_TIMEOUT_SECONDS", 60))
+
+# Plain text formats are cheap to decode, so they skip the worker processes
+INLINE_EXTENSIONS = {'.txt', '.md', '.json'}
+
+# Imported once by the fork server so every worker process starts with the parsers loaded
+WORKER_PRELOAD_MODULES = ["document_utils", "fitz", "docx", "PyPDF2"]
+
+def _extract_bytes(data, file_extension):
+    """Worker process task: extract text from raw document bytes."""
+    return extract_text_from_document(io.BytesIO(data), file_extension, MAX_DOCUMENT_CHARS)
+
+def _run_task(connection, target, args):
+    """Worker process entry point: run one task and send back (ok, text)."""
+    try:
+        connection.send((True, target(*args)))
+    except Exception as e:
+        connection.send((False, str(e)))
+    finally:
+        connection.close()
+
+def _worker_context():
+    # Forking from a clean fork server is cheap and, unlike forking the app
+    # itself, does not copy its Mongo/HTTP clients and threads
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(WORKER_PRELOAD_MODULES)
+        return context
+    return multiprocessing.get_context("spawn")
+
+class DocumentIngestor:
+    """Extracts uploaded documents concurrently, each in a worker process of its own.
+
+    PDF/DOCX/CSV parsing is CPU-bound and holds the GIL, so every file, or page
+    range of a large PDF, is parsed in a short-lived process, at most
+    max_workers at a time across all requests. A task that runs past its
+    timeout is killed on its own without touching anyone else's. Cached
+    documents never start a process, and results always come back in upload
+    order.
+    """
+
+    def __init__(self, extraction_cache, max_workers=INGESTION_MAX_WORKERS,
+                 file_timeout_seconds=INGESTION_FILE_TIMEOUT_SECONDS,
+                 pdf_split_threshold=PDF_PARALLEL_PAGE_THRESHOLD):
+        self.extraction_cache = extraction_cache
+        self.max_workers = max_workers
+        self.file_timeout_seconds = file_timeout_seconds
+        self.pdf_split_threshold = pdf_split_threshold
+        self._context = _worker_context()
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._processes = set()
+        self._processes_lock = threading.Lock()
+
+    def extract_all(self, uploads):
+        """Extract text for a list of (data, file_extension) pairs, preserving their order."""
+        started = time.perf_counter()
+        results = [None] * len(uploads)
+        keys = [content_cache_key(data, ext) for data, ext in uploads]
+        pending = {}
+        extracted = []
+
+        for idx, (data, file_extension) in enumerate(uploads):
+            cached = self.extraction_cache.get(keys[idx])
+            if cached is not None:
+                results[idx] = cached
+            elif file_extension.lower() in INLINE_EXTENSIONS:
+                results[idx] = _extract_bytes(data, file_extension)
+                extracted.append(idx)
+            else:
+                pending[idx] = (data, file_extension)
+
+        if pending:
+            self._extract_in_workers(pending, results)
+            extracted.extend(pending)
+
+        for idx in extracted:
+            if not is_extraction_error(results[idx]):
+                self.extraction_cache.put(keys[idx], results[idx])
+
+        logger.info(f"Ingested {len(uploads)} document(s) ({len(pending)} parsed in worker processes) in {(time.perf_counter() - started) * 1000:.0f}ms")
+        return results
+
+    def _plan_pdf_ranges(self, data, file_extension):
+        """Return (num_pages, page ranges) if a PDF is large enough to split across workers."""
+        if not self.pdf_split_threshold or file_extension.lower() != '.pdf' or PDF_EXTRACTION_ENGINE != 'pymupdf':
+            return None
+        try:
+            num_pages = count_pdf_pages(data)
+        except Exception:
+            # Not readable by PyMuPDF; let the regular extractor report or fall back
+            return None
+        if num_pages < self.pdf_split_threshold:
+            return None
+        return num_pages, pdf_page_ranges(num_pages)
+
+    def _extract_in_workers(self, pending, results):
+        tasks = []  # (idx, target, args)
+        split_pages = {}  # idx -> page count of PDFs split into page ranges
+        for idx, (data, ext) in pending.items():
+            plan = self._plan_pdf_ranges(data, ext)
+            if plan:
+                # Large PDFs are split into page ranges that run side by side
+                num_pages, ranges = plan
+                split_pages[idx] = num_pages
+                tasks.extend((idx, extract_pdf_page_range, (data, start, end)) for start, end in ranges)
+            else:
+                tasks.append((idx, _extract_bytes, (data, ext)))
+
+        outcomes = self._run_tasks(tasks)
+
+        for idx in pending:
+            file_outcomes = [outcome for task, outcome in zip(tasks, outcomes) if task[0] == idx]
+            error = next((text for ok, text in file_outcomes if not ok), None)
+            if error is not None:
+                logger.error(f"Error extracting text from document: {error}")
+                results[idx] = f"Error extracting document text: {error}"
+            elif idx in split_pages:
+                blocks = itertools.chain([format_pdf_text(split_pages[idx], [])], (text for _, text in file_outcomes))
+                if MAX_DOCUMENT_CHARS:
+                    blocks = take_within_budget(blocks, MAX_DOCUMENT_CHARS)
+                results[idx] = "".join(blocks)
+            else:
+                results[idx] = file_outcomes[0][1]
+
+    def _run_tasks(self, tasks):
+        """Run (idx, target, args) tasks in worker processes and return an (ok, text) outcome per task.
+
+        Each task gets file_timeout_seconds from the moment its process starts,
+        so time spent waiting for a free worker does not count against it.
+        """
+        outcomes = [None] * len(tasks)
+        queued = deque(range(len(tasks)))
+        running = {}  # connection -> (task number, process, deadline)
+        try:
+            while queued or running:
+                # Block for a free worker only while none of ours is running, so
+                # requests already holding workers never wait on each other
+                while queued and self._slots.acquire(blocking=not running):
+                    number = queued.popleft()
+                    _, target, args = tasks[number]
+                    try:
+                        connection, process = self._start(target, args)
+                    except Exception as e:
+                        self._slots.release()
+                        logger.error(f"Could not start a document worker process, extracting inline: {str(e)}")
+                        outcomes[number] = self._run_inline(target, args)
+                        continue
+                    running[connection] = (number, process, time.monotonic() + self.file_timeout_seconds)
+
+                if not running:
+                    continue
+                timeout = max(0, min(deadline for _, _, deadline in running.values()) - time.monotonic())
+                for connection in wait(list(running), timeout):
+                    number, process, _ = running.pop(connection)
+                    outcomes[number] = self._receive(connection, process)
+
+                now = time.monotonic()
+                for connection, (number, process, deadline) in list(running.items()):
+                    if deadline <= now:
+                        del running[connection]
+                        logger.error(f"Document extraction timed out after {self.file_timeout_seconds}s, killing worker process {process.pid}")
+                        self._finish(connection, process, kill=True)
+                        outcomes[number] = (False, f"timed out after {self.file_timeout_seconds}s")
+        finally:
+            for connection, (_, process, _) in running.items():
+                self._finish(connection, process, kill=True)
+        return outcomes
+
+    def _start(self, target, args):
+        receiver, sender = self._context.Pipe(duplex=False)
+        try:
+            process = self._context.Process(target=_run_task, args=(sender, target, args), daemon=True)
+            process.start()
+        except Exception:
+            receiver.close()
+            raise
+        finally:
+            sender.close()
+        with self._processes_lock:
+            self._processes.add(process)
+        return receiver, process
+
+    def _receive(self, connection, process):
+        try:
+            outcome = connection.recv()
+        except EOFError:
+            # The process died without answering, e.g. the parser crashed
+            outcome = None
+        self._finish(connection, process)
+        return outcome or (False, f"worker process exited with code {process.exitcode}")
+
+    def _finish(self, connection, process, kill=False):
+        if kill:
+            process.kill()
+        process.join()
+        connection.close()
+        with self._processes_lock:
+            self._processes.discard(process)
+        self._slots.release()
+
+    def _run_inline(self, target, args):
+        try:
+            return True, target(*args)
+        except Exception as e:
+            return False, str(e)
+
+    def shutdown(self):
+        """Kill worker processes that are still running."""
+        with self._processes_lock:
+            processes = list(self._processes)
+        for process in processes:
+            process.kill()
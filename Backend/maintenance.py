@@ -0,0 +1,202 @@
+import os
+import time
+import uuid
+import socket
+import threading
+import logging
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Maintenance configuration
+MAINTENANCE_INTERVAL_SECONDS = int(os.environ.get("MAINTENANCE_INTERVAL_SECONDS", 300))
+CHAT_ARCHIVE_AFTER_DAYS = int(os.environ.get("CHAT_ARCHIVE_AFTER_DAYS", 90))
+MAINTENANCE_LOCK_TTL_SECONDS = int(os.environ.get("MAINTENANCE_LOCK_TTL_SECONDS", MAINTENANCE_INTERVAL_SECONDS * 2))
+
+ARCHIVAL_LOCK_NAME = "chat-archival"
+
+class LeaderLock:
+    """Lease-based lock stored in a Mongo collection.
+
+    The holder renews the lease on every acquire; another replica can only take
+    over once the lease has expired, so at most one replica archives at a time.
+    """
+
+    def __init__(self, locks_collection, name, ttl_seconds):
+        self.locks_collection = locks_collection
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def acquire(self):
+        """Acquire or renew the lease. Returns True if this process is the leader."""
+        now = datetime.now()
+        try:
+            lock = self.locks_collection.find_one_and_update(
+                {
+                    "_id": self.name,
+                    "$or": [
+                        {"owner": self.owner},
+                        {"expires_at": {"$lt": now}}
+                    ]
+                },
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.ttl_seconds)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            return lock is not None and lock.get("owner") == self.owner
+        except DuplicateKeyError:
+            # The lock exists and is held by another replica
+            return False
+
+    def release(self):
+        try:
+            self.locks_collection.delete_one({"_id": self.name, "owner": self.owner})
+        except Exception as e:
+            logger.warning(f"Failed to release lock {self.name}: {str(e)}")
+
+class MaintenanceScheduler:
+    """Background thread that expires conversation contexts, archives old chats and collects stored documents.
+
+    Context expiry is local to each process and runs on every replica. Chat
+    archival and document collection are database-wide writes, so they only
+    run on the replica holding the archival leader lock.
+    """
+
+    def __init__(self, conversation_store, chats_collection, locks_collection,
+                 document_store=None, projects_collection=None,
+                 interval_seconds=MAINTENANCE_INTERVAL_SECONDS,
+                 archive_after_days=CHAT_ARCHIVE_AFTER_DAYS,
+                 lock_ttl_seconds=MAINTENANCE_LOCK_TTL_SECONDS):
+        self.conversation_store = conversation_store
+        self.chats_collection = chats_collection
+        self.document_store = document_store
+        self.projects_collection = projects_collection
+        self.interval_seconds = interval_seconds
+        self.archive_after_days = archive_after_days
+        self.lock = LeaderLock(locks_collection, ARCHIVAL_LOCK_NAME, lock_ttl_seconds)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "runs": 0,
+            "archive_runs": 0,
+            "conversations_expired": 0,
+            "chats_matched": 0,
+            "chats_archived": 0,
+            "project_references_removed": 0,
+            "documents_collected": 0,
+            "errors": 0,
+            "is_leader": False,
+            "last_run_at": None,
+            "last_run_ms": None
+        }
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="maintenance-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"Maintenance scheduler started (interval {self.interval_seconds}s)")
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.lock.release()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            self.run_once()
+
+    def run_once(self):
+        """Run one maintenance pass."""
+        started = time.perf_counter()
+
+        try:
+            expired = self.conversation_store.expire()
+            if expired:
+                logger.info(f"Cleaned up {expired} expired conversations from memory")
+            with self._metrics_lock:
+                self._metrics["conversations_expired"] += expired
+        except Exception as e:
+            logger.error(f"Error expiring conversations: {str(e)}")
+            self._record_error()
+
+        try:
+            is_leader = self.lock.acquire()
+            with self._metrics_lock:
+                self._metrics["is_leader"] = is_leader
+            if is_leader:
+                self.archive_old_chats()
+        except Exception as e:
+            logger.error(f"Error archiving old chats: {str(e)}")
+            self._record_error()
+            is_leader = False
+
+        if is_leader and self.document_store is not None:
+            try:
+                self.collect_documents()
+            except Exception as e:
+                logger.error(f"Error collecting stored documents: {str(e)}")
+                self._record_error()
+
+        with self._metrics_lock:
+            self._metrics["runs"] += 1
+            self._metrics["last_run_at"] = datetime.now().isoformat()
+            self._metrics["last_run_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    def archive_old_chats(self):
+        """Mark chats that have not been updated for a long time as archived."""
+        threshold = datetime.now() - timedelta(days=self.archive_after_days)
+
+        # Skip chats that are already archived so repeated runs only touch new rows
+        archive_result = self.chats_collection.update_many(
+            {
+                "is_deleted": False,
+                "is_archived": {"$ne": True},
+                "updated_at": {"$lt": threshold}
+            },
+            {"$set": {"is_archived": True}}
+        )
+
+        with self._metrics_lock:
+            self._metrics["archive_runs"] += 1
+            self._metrics["chats_matched"] += archive_result.matched_count
+            self._metrics["chats_archived"] += archive_result.modified_count
+
+        if archive_result.modified_count > 0:
+            logger.info(f"Archived {archive_result.modified_count} old chats in the database")
+
+    def collect_documents(self):
+        """Drop references to deleted projects, then delete document text nothing references any more."""
+        removed = 0
+        if self.projects_collection is not None:
+            # Projects are deleted outside this service, so their references are found here
+            project_ids = self.document_store.references_collection.distinct("project_id", {"project_id": {"$ne": None}})
+            if project_ids:
+                existing = set(self.projects_collection.distinct("_id", {"_id": {"$in": project_ids}}))
+                for project_id in project_ids:
+                    if project_id not in existing:
+                        removed += self.document_store.remove_references(project_id=project_id)
+
+        collected = self.document_store.collect_garbage()
+
+        with self._metrics_lock:
+            self._metrics["project_references_removed"] += removed
+            self._metrics["documents_collected"] += collected
+
+        if removed > 0:
+            logger.info(f"Removed {removed} document references of deleted projects")
+
+    def _record_error(self):
+        with self._metrics_lock:
+            self._metrics["errors"] += 1
+
+    def stats(self):
+        with self._metrics_lock:
+            return dict(self._metrics)
@@ -0,0 +1,86 @@
+import os
+import json
+import time
+import base64
+import threading
+import logging
+from datetime import datetime
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Pagination configuration
+CHAT_COUNT_CACHE_SECONDS = int(os.environ.get("CHAT_COUNT_CACHE_SECONDS", 60))
+MAX_PAGE_LIMIT = int(os.environ.get("MAX_PAGE_LIMIT", 100))
+# Messages returned by a chat request that does not ask for a page size
+MAX_CHAT_MESSAGES = int(os.environ.get("MAX_CHAT_MESSAGES", 1000))
+
+def encode_cursor(updated_at, chat_id):
+    """Encode the sort key of the last chat on a page as an opaque cursor."""
+    payload = json.dumps({"updated_at": updated_at.isoformat(), "id": chat_id})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    """Decode a cursor back into (updated_at, chat_id); raises ValueError if it is malformed."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(payload["updated_at"]), payload["id"]
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {str(e)}")
+
+def keyset_filter(updated_at, chat_id):
+    """Match chats sorted after (updated_at, _id) in descending order."""
+    return {
+        "$or": [
+            {"updated_at": {"$lt": updated_at}},
+            {"updated_at": updated_at, "_id": {"$lt": chat_id}}
+        ]
+    }
+
+def parse_int_param(value, default, name):
+    """Parse an integer query parameter; raises ValueError naming the parameter if it is not one."""
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name} parameter: {value!r} is not a number")
+
+def parse_limit(value, default):
+    """Parse a page size from a query parameter, clamped to 1..MAX_PAGE_LIMIT; raises ValueError if malformed."""
+    return max(1, min(parse_int_param(value, default, "limit"), MAX_PAGE_LIMIT))
+
+class CountCache:
+    """Short-lived cache of per-user chat counts.
+
+    Counting a user's chats is a full index range scan, so the sidebar total
+    is served from here and refreshed at most every ttl_seconds or when the
+    user's chats change.
+    """
+
+    def __init__(self, ttl_seconds=CHAT_COUNT_CACHE_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._counts = {}  # key -> (count, expires_at)
+        self._lock = threading.Lock()
+
+    def get_or_count(self, key, count_function):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._counts.get(key)
+            if cached and cached[1] > now:
+                return cached[0]
+        count = count_function()
+        with self._lock:
+            self._counts[key] = (count, now + self.ttl_seconds)
+            # Drop expired entries so the cache does not grow with every user ever seen
+            if len(self._counts) > 10000:
+                self._counts = {k: v for k, v in self._counts.items() if v[1] > now}
+        return count
+
+    def invalidate(self, key):
+        with self._lock:
+            self._counts.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
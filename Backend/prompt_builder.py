@@ -0,0 +1,206 @@
+import os
+import json
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Context window per model deployment, in tokens. Override or extend with MODEL_CONTEXT_WINDOWS (JSON).
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4.1": 1000000,
+    "gpt-4.1-mini": 1000000,
+    "o1": 200000,
+    "o3-mini": 200000,
+    "gpt-4": 8192,
+    "gpt-35-turbo": 16385
+}
+MODEL_CONTEXT_WINDOWS.update(json.loads(os.environ.get("MODEL_CONTEXT_WINDOWS", "{}")))
+DEFAULT_CONTEXT_WINDOW = int(os.environ.get("DEFAULT_CONTEXT_WINDOW", 128000))
+
+# Optional hard cap on prompt size regardless of the model's window, to bound cost and latency (0 disables it)
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", 0))
+# Most recent user/assistant turns kept ahead of documents
+MIN_HISTORY_TURNS = int(os.environ.get("MIN_HISTORY_TURNS", 2))
+
+# Per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Headroom for tokenizer drift between our count and the service's
+SAFETY_MARGIN_TOKENS = 256
+
+DOCUMENTS_HEADER = "Here are the documents that I'd like you to work with:\n\n"
+DOCUMENT_SEPARATOR = "-" * 40 + "\n\n"
+TRUNCATION_MARKER = "\n... [document truncated to fit the context window] ..."
+
+_encodings = {}
+
+def get_encoding_name(model_name):
+    """Pick the tiktoken encoding for a deployment name."""
+    if model_name.startswith(("gpt-4o", "gpt-4.1", "o1", "o3", "o4")):
+        return "o200k_base"
+    return "cl100k_base"
+
+def _get_encoding(encoding_name):
+    if encoding_name not in _encodings:
+        try:
+            import tiktoken
+            _encodings[encoding_name] = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            # tiktoken missing or its BPE file cannot be fetched: fall back to an estimate
+            logger.warning(f"tiktoken unavailable ({str(e)}), estimating tokens from characters")
+            _encodings[encoding_name] = None
+    return _encodings[encoding_name]
+
+def count_tokens(text, encoding_name="o200k_base"):
+    """Count tokens locally, or estimate ~4 characters per token without tiktoken."""
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text, max_tokens, encoding_name="o200k_base"):
+    """Cut text down to at most max_tokens tokens."""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+def message_text(message):
+    """Concatenate the text blocks of a chat message."""
+    content = message.get("content", "")
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+def text_message(role, text):
+    return {"role": role, "content": [{"type": "text", "text": text}]}
+
+def count_message_tokens(message, encoding_name):
+    return count_tokens(message_text(message), encoding_name) + MESSAGE_OVERHEAD_TOKENS
+
+def get_prompt_budget(model_name, max_completion_tokens):
+    """Tokens available for the prompt: the model's window minus the completion, optionally capped."""
+    context_window = MODEL_CONTEXT_WINDOWS.get(model_name, DEFAULT_CONTEXT_WINDOW)
+    budget = context_window - max_completion_tokens - SAFETY_MARGIN_TOKENS
+    if PROMPT_TOKEN_BUDGET:
+        budget = min(budget, PROMPT_TOKEN_BUDGET)
+    return budget
+
+def document_token_count(doc, encoding_name):
+    """Token count of a document's text, cached on the document per encoding."""
+    counts = doc.setdefault("token_counts", {})
+    if encoding_name not in counts:
+        counts[encoding_name] = count_tokens(doc["text"], encoding_name)
+    return counts[encoding_name]
+
+def format_document_block(idx, doc, text):
+    return f"DOCUMENT {idx+1}: {doc['name']}\nTYPE: {doc['type']}\nCONTENT:\n{text}\n\n" + DOCUMENT_SEPARATOR
+
+def fit_documents(documents, budget, encoding_name):
+    """Share a token budget between documents, truncating the largest ones first.
+
+    Small documents are kept whole; whatever is left is split evenly between
+    the documents that do not fit (water-filling).
+    """
+    sizes = [document_token_count(doc, encoding_name) for doc in documents]
+    allowances = [0] * len(documents)
+    remaining = budget
+    order = sorted(range(len(documents)), key=lambda i: sizes[i])
+    for position, idx in enumerate(order):
+        fair_share = remaining // (len(order) - position)
+        allowances[idx] = min(sizes[idx], fair_share)
+        remaining -= allowances[idx]
+
+    marker_tokens = count_tokens(TRUNCATION_MARKER, encoding_name)
+    blocks = []
+    for idx, doc in enumerate(documents):
+        text = doc["text"]
+        if allowances[idx] < sizes[idx]:
+            text = truncate_to_tokens(text, allowances[idx] - marker_tokens, encoding_name) + TRUNCATION_MARKER
+        blocks.append(format_document_block(idx, doc, text))
+    return blocks, sum(allowances) < sum(sizes)
+
+def build_budgeted_prompt(model_name, system_prompt, documents, history, user_prompt,
+                          include_documents=True, new_documents_added=False, max_completion_tokens=2000):
+    """Assemble the chat prompt so it fits the model's token budget.
+
+    Parts are kept in priority order: the system prompt and current user turn,
+    then the most recent MIN_HISTORY_TURNS turns, then the documents, then the
+    rest of the history from newest to oldest. Returns (messages, stats).
+    """
+    encoding_name = get_encoding_name(model_name)
+    budget = get_prompt_budget(model_name, max_completion_tokens)
+
+    system_message = text_message("system", system_prompt or "")
+    user_message = text_message("user", user_prompt)
+    ack_message = None
+    if include_documents and documents and new_documents_added:
+        ack_message = text_message(
+            "assistant",
+            f"I've received {len(documents)} document(s). I'll analyze them and can answer any questions you have about their content."
+        )
+
+    used = count_message_tokens(system_message, encoding_name)
+    user_tokens = count_message_tokens(user_message, encoding_name)
+    if used + user_tokens > budget:
+        # Even the user's own message does not fit; keep as much of it as we can
+        user_message = text_message("user", truncate_to_tokens(user_prompt, budget - used - MESSAGE_OVERHEAD_TOKENS, encoding_name))
+        user_tokens = budget - used
+    used += user_tokens
+    ack_tokens = count_message_tokens(ack_message, encoding_name) if ack_message else 0
+
+    # Walk history newest first; the first MIN_HISTORY_TURNS turns outrank documents
+    history_tokens = [count_message_tokens(message, encoding_name) for message in history]
+    kept_from = len(history)
+    priority_messages = MIN_HISTORY_TURNS * 2
+    while kept_from > 0 and len(history) - kept_from < priority_messages:
+        if used + history_tokens[kept_from - 1] > budget:
+            break
+        used += history_tokens[kept_from - 1]
+        kept_from -= 1
+
+    documents_message = None
+    documents_truncated = False
+    document_tokens = 0
+    if include_documents and documents:
+        header_tokens = count_tokens(DOCUMENTS_HEADER, encoding_name) + MESSAGE_OVERHEAD_TOKENS
+        separator_tokens = count_tokens(format_document_block(0, {"name": "", "type": ""}, ""), encoding_name)
+        available = budget - used - ack_tokens - header_tokens - separator_tokens * len(documents)
+        if available > 0:
+            blocks, documents_truncated = fit_documents(documents, available, encoding_name)
+            documents_message = text_message("user", DOCUMENTS_HEADER + "".join(blocks))
+            document_tokens = count_message_tokens(documents_message, encoding_name)
+            used += document_tokens + ack_tokens
+        else:
+            documents_truncated = True
+
+    # Older history fills whatever is left
+    while kept_from > 0 and used + history_tokens[kept_from - 1] <= budget:
+        used += history_tokens[kept_from - 1]
+        kept_from -= 1
+
+    chat_prompt = [system_message]
+    if documents_message:
+        chat_prompt.append(documents_message)
+        if ack_message:
+            chat_prompt.append(ack_message)
+    chat_prompt.extend(history[kept_from:])
+    chat_prompt.append(user_message)
+
+    stats = {
+        "model": model_name,
+        "encoding": encoding_name,
+        "budget_tokens": budget,
+        "total_tokens": used,
+        "document_tokens": document_tokens,
+        "documents_truncated": documents_truncated,
+        "history_messages_kept": len(history) - kept_from,
+        "history_messages_dropped": kept_from
+    }
+    return chat_prompt, stats
@@ -0,0 +1,113 @@
+"""Checks for the declared indexes and the query plan checker in indexes.py.
+
+Run from the Backend directory: python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from indexes import INDEX_SPECS, IndexManager, find_plan_stages, uses_collection_scan
+
+def spec_id(spec):
+    return f"{spec['collection']}:{'_'.join(field for field, _ in spec['keys'])}"
+
+def index_scan_plan(spec, sort):
+    """A winning plan of the shape MongoDB returns when the spec's index serves the query."""
+    plan = {
+        "stage": "FETCH",
+        "inputStage": {
+            "stage": "IXSCAN",
+            "keyPattern": dict(spec["keys"]),
+            "indexName": "_".join(f"{field}_{direction}" for field, direction in spec["keys"])
+        }
+    }
+    return {"queryPlanner": {"namespace": f"db.{spec['collection']}", "winningPlan": plan}}
+
+def collection_scan_plan(spec, sort):
+    """A winning plan for the same query with no usable index."""
+    plan = {"stage": "COLLSCAN", "direction": "forward"}
+    if sort:
+        plan = {"stage": "SORT", "sortPattern": dict(sort), "inputStage": plan}
+    return {"queryPlanner": {"namespace": f"db.{spec['collection']}", "winningPlan": plan}}
+
+def query_shapes():
+    return [
+        pytest.param(spec, query_filter, sort, id=spec_id(spec))
+        for spec in INDEX_SPECS
+        for query_filter, sort in spec["queries"]
+    ]
+
+@pytest.mark.parametrize("spec, query_filter, sort", query_shapes())
+def test_index_scan_is_accepted(spec, query_filter, sort):
+    assert not uses_collection_scan(index_scan_plan(spec, sort))
+
+@pytest.mark.parametrize("spec, query_filter, sort", query_shapes())
+def test_collection_scan_is_reported(spec, query_filter, sort):
+    assert uses_collection_scan(collection_scan_plan(spec, sort))
+
+def test_rejected_plans_are_ignored():
+    explain_output = {
+        "queryPlanner": {
+            "winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}},
+            "rejectedPlans": [{"stage": "COLLSCAN"}]
+        }
+    }
+    assert not uses_collection_scan(explain_output)
+
+def test_collection_scan_under_or_is_found():
+    plan = {"stage": "SUBPLAN", "inputStage": {"stage": "OR", "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}]}}
+    assert find_plan_stages(plan) == ["SUBPLAN", "OR", "IXSCAN", "COLLSCAN"]
+    assert uses_collection_scan({"queryPlanner": {"winningPlan": plan}})
+
+def test_plan_without_query_planner_wrapper():
+    assert uses_collection_scan({"winningPlan": {"stage": "COLLSCAN"}})
+    assert not uses_collection_scan({"winningPlan": {"stage": "IXSCAN"}})
+
+def test_specs_are_well_formed():
+    for spec in INDEX_SPECS:
+        assert spec["keys"], spec_id(spec)
+        assert spec["used_by"], spec_id(spec)
+        # Every index serves a query, except TTL indexes that only expire documents
+        assert spec["queries"] or "expire_after_seconds" in spec, spec_id(spec)
+        for query_filter, sort in spec["queries"]:
+            assert isinstance(query_filter, dict)
+            assert sort is None or all(field for field, _ in sort)
+
+class RecordingCollection:
+    def __init__(self, calls, name):
+        self.calls = calls
+        self.name = name
+
+    def create_index(self, keys, **options):
+        self.calls.append((self.name, keys, options))
+
+class RecordingDatabase:
+    def __init__(self):
+        self.calls = []
+
+    def __getitem__(self, name):
+        return RecordingCollection(self.calls, name)
+
+def test_ttl_specs_create_expiring_indexes():
+    db = RecordingDatabase()
+    manager = IndexManager(db, verify_query_plans=False)
+    manager.run()
+
+    assert len(db.calls) == len(INDEX_SPECS)
+    for spec, (collection, keys, options) in zip(INDEX_SPECS, db.calls):
+        assert collection == spec["collection"]
+        assert keys == spec["keys"]
+        if "expire_after_seconds" in spec:
+            assert options == {"expireAfterSeconds": spec["expire_after_seconds"]}
+        else:
+            assert options == {}
+    assert manager.stats()["indexes_ensured"] == len(INDEX_SPECS)
+
+def test_cleanup_specs_are_declared():
+    ttl_collections = {spec["collection"] for spec in INDEX_SPECS if "expire_after_seconds" in spec}
+    assert {"extraction_cache", "locks"} <= ttl_collections
+    # Stored document text is deleted by DocumentStore.collect_garbage rather than a TTL
+    assert any(spec["collection"] == "document_contents" and spec["keys"] == [("unreferenced_at", 1)] for spec in INDEX_SPECS)
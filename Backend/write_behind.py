@@ -0,0 +1,260 @@
+import os
+import time
+import queue
+import atexit
+import threading
+import logging
+from collections import OrderedDict
+from pymongo import InsertOne
+from pymongo.errors import AutoReconnect, BulkWriteError, ExecutionTimeout, NetworkTimeout, OperationFailure
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Write-behind configuration
+WRITE_BEHIND_MAX_QUEUE = int(os.environ.get("WRITE_BEHIND_MAX_QUEUE", 10000))
+WRITE_BEHIND_BATCH_SIZE = int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", 100))
+WRITE_BEHIND_FLUSH_MS = int(os.environ.get("WRITE_BEHIND_FLUSH_MS", 200))
+WRITE_BEHIND_MAX_RETRIES = int(os.environ.get("WRITE_BEHIND_MAX_RETRIES", 5))
+
+# Chats whose dropped-turn counts are reported in stats
+MAX_TRACKED_DROPPED_CHATS = 100
+
+# Cosmos DB reports request-rate throttling as 16500; 11600/11602 are interrupted operations
+TRANSIENT_ERROR_CODES = {16500, 11600, 11602, 89, 91, 189, 262}
+
+def is_transient_error(error):
+    """Return True for errors that are worth retrying."""
+    if isinstance(error, (AutoReconnect, NetworkTimeout, ExecutionTimeout)):
+        return True
+    if isinstance(error, OperationFailure) and not isinstance(error, BulkWriteError):
+        return error.code in TRANSIENT_ERROR_CODES
+    return False
+
+class WriteBehindQueue:
+    """Bounded in-process queue that persists chat turns off the request path.
+
+    A worker thread drains the queue in batches. Queued turns are grouped per
+    chat so each chat needs a single order reservation for the whole batch,
+    then every message in the batch is written with one bulk_write. Messages
+    that already have an order can be queued directly. Nothing is queued until
+    start() has run the worker.
+    """
+
+    def __init__(self, conversations_collection, reserve_orders,
+                 max_queue=WRITE_BEHIND_MAX_QUEUE, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 flush_ms=WRITE_BEHIND_FLUSH_MS, max_retries=WRITE_BEHIND_MAX_RETRIES):
+        """
+        reserve_orders(chat_id, user_id, model_name, chat_title, document_names, count)
+        must return the last order reserved for the chat, or None if the chat
+        belongs to another user.
+        """
+        self.conversations_collection = conversations_collection
+        self.reserve_orders = reserve_orders
+        self.batch_size = batch_size
+        self.flush_seconds = flush_ms / 1000
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop_event = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "rejected_full": 0,
+            "batches_written": 0,
+            "messages_written": 0,
+            "retries": 0,
+            "dropped": 0,
+            "max_depth": 0
+        }
+        self._dropped_turns_by_chat = OrderedDict()  # chat_id -> turns dropped, most recent last
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start the worker thread; safe to call more than once."""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def enqueue_turn(self, chat_id, user_id, model_name, chat_title, document_names, message):
+        """Queue a chat turn whose message order is assigned when it is written.
+
+        Returns False if the queue is full or not started; the caller should
+        then write synchronously.
+        """
+        return self._put(("turn", (chat_id, user_id, model_name, chat_title, document_names, message)))
+
+    def enqueue_message(self, message):
+        """Queue a message that already has its order."""
+        return self._put(("message", message))
+
+    def _put(self, item):
+        if self._thread is None or self._stop_event.is_set():
+            return False
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._bump("rejected_full")
+            return False
+        with self._stats_lock:
+            self._stats["enqueued"] += 1
+            self._stats["max_depth"] = max(self._stats["max_depth"], self._queue.qsize())
+        return True
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write_batch_safely(batch)
+
+    def _write_batch_safely(self, batch):
+        # An unexpected error loses this batch but must not stop the worker
+        try:
+            self._write_batch(batch)
+        except Exception as e:
+            logger.error(f"Error writing {len(batch)} queued item(s), dropping them: {str(e)}")
+            self._bump("dropped", len(batch))
+
+    def _write_batch(self, batch):
+        messages = []
+
+        # Group turns per chat, keeping their queue order, so each chat needs one reservation
+        turns_by_chat = OrderedDict()
+        for kind, payload in batch:
+            if kind == "message":
+                messages.append(payload)
+            else:
+                turns_by_chat.setdefault((payload[0], payload[1]), []).append(payload)
+
+        for (chat_id, user_id), turns in turns_by_chat.items():
+            # A new chat takes its title from the first turn, everything else from the latest
+            chat_title = turns[0][3]
+            model_name, document_names = turns[-1][2], turns[-1][4]
+
+            # A retried $inc that had in fact been applied only leaves a gap in
+            # the order sequence, never a duplicate
+            last_order = self._with_retries(
+                lambda: self.reserve_orders(chat_id, user_id, model_name, chat_title, document_names, len(turns))
+            )
+            if last_order is None:
+                self._record_dropped_turns(chat_id, user_id, len(turns))
+                continue
+
+            first_order = last_order - len(turns) + 1
+            for offset, turn in enumerate(turns):
+                message = turn[5]
+                message["order"] = first_order + offset
+                messages.append(message)
+
+        if messages:
+            self._bulk_insert(messages)
+
+    def _bulk_insert(self, messages):
+        pending = messages
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.conversations_collection.bulk_write([InsertOne(m) for m in pending], ordered=False)
+                self._bump("messages_written", len(pending))
+                self._bump("batches_written")
+                return
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors", [])
+                failed = {err["index"] for err in write_errors}
+                retryable = [
+                    pending[err["index"]] for err in write_errors
+                    if err.get("code") in TRANSIENT_ERROR_CODES
+                ]
+                # Duplicate keys on a retry mean the earlier attempt already landed
+                permanent = [err for err in write_errors if err.get("code") not in TRANSIENT_ERROR_CODES and err.get("code") != 11000]
+                self._bump("messages_written", len(pending) - len(failed))
+                if permanent:
+                    logger.error(f"Dropping {len(permanent)} message(s) after write errors: {permanent[0].get('errmsg')}")
+                    self._bump("dropped", len(permanent))
+                pending = retryable
+            except Exception as e:
+                if not is_transient_error(e):
+                    logger.error(f"Error writing {len(pending)} queued messages to Cosmos DB: {str(e)}")
+                    self._bump("dropped", len(pending))
+                    return
+
+            if not pending:
+                self._bump("batches_written")
+                return
+            if attempt < self.max_retries:
+                self._bump("retries")
+                time.sleep(min(0.1 * (2 ** attempt), 5))
+
+        logger.error(f"Giving up on {len(pending)} queued messages after {self.max_retries} retries")
+        self._bump("dropped", len(pending))
+
+    def _with_retries(self, operation):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return operation()
+            except Exception as e:
+                if not is_transient_error(e) or attempt == self.max_retries:
+                    logger.error(f"Error reserving message order: {str(e)}")
+                    return None
+                self._bump("retries")
+                time.sleep(min(0.1 * (2 ** attempt), 5))
+
+    def flush(self):
+        """Synchronously write out everything that is currently queued."""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._write_batch_safely(batch)
+                batch = []
+        if batch:
+            self._write_batch_safely(batch)
+
+    def close(self, timeout=10):
+        """Stop the worker and flush the queue; safe to call more than once."""
+        if self._stop_event.is_set():
+            return
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+        logger.info("Write-behind queue flushed")
+
+    def _record_dropped_turns(self, chat_id, user_id, count):
+        with self._stats_lock:
+            self._stats["dropped"] += count
+            dropped = self._dropped_turns_by_chat.pop(chat_id, 0) + count
+            self._dropped_turns_by_chat[chat_id] = dropped
+            while len(self._dropped_turns_by_chat) > MAX_TRACKED_DROPPED_CHATS:
+                self._dropped_turns_by_chat.popitem(last=False)
+        logger.error(f"Dropping {count} queued turn(s) for chat {chat_id} (User: {user_id}), {dropped} dropped for this chat so far")
+
+    def _bump(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["dropped_turns_by_chat"] = dict(self._dropped_turns_by_chat)
+        stats["depth"] = self.depth()
+        return stats